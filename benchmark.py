@@ -0,0 +1,243 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pda import PDA
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+DEFAULT_SIZES = (5, 20, 50)
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+BENCHMARK_VERSION = 1
+TIMING_NOISE = 0.005
+INPUT_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+STACK_LETTERS = 'ZABCDEFGHIJKLMNOPQRSTUVWXY'
+
+
+def generate_pda(file_name, states=10, input_symbols=2, stack_symbols=3, density=4.0, push_ratio=0.5,
+                 final_ratio=0.25, seed=0):
+    # Random PDA in the XML schema PDA.load_file reads. density is the mean
+    # number of transitions per state; push_ratio of them push a symbol on
+    # top of the one they read, the others pop it. About a third of all
+    # transitions read λ from the input.
+    rng = random.Random(seed)
+    state_names = ['q{}'.format(i) for i in range(states)]
+    # Stack writes are split into single characters, so stack symbols are letters
+    if not 1 <= stack_symbols <= len(STACK_LETTERS) or not 1 <= input_symbols <= len(INPUT_LETTERS):
+        raise Exception('Alphabets are limited to {} stack and {} input symbols'.format(
+            len(STACK_LETTERS), len(INPUT_LETTERS)))
+    input_names = list(INPUT_LETTERS[:input_symbols])
+    stack_names = list(STACK_LETTERS[:stack_symbols])
+    final_names = rng.sample(state_names, max(1, round(states * final_ratio)))
+    n_transitions = max(1, round(states * density))
+
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<Automata type="PDA">\n    <Alphabets>\n')
+        f.write('        <Input_alphabets numberOfInputAlphabets="{}">\n'.format(len(input_names)))
+        for name in input_names:
+            f.write('            <alphabet letter="{}" />\n'.format(name))
+        f.write('        </Input_alphabets>\n')
+        f.write('        <Stack_alphabets numberOfStackAlphabets="{}">\n'.format(len(stack_names)))
+        for name in stack_names:
+            f.write('            <alphabet letter="{}" />\n'.format(name))
+        f.write('            <tail letter="Z" />\n        </Stack_alphabets>\n    </Alphabets>\n')
+        f.write('    <States numberOfStates="{}">\n'.format(states))
+        for name in state_names:
+            f.write('        <state name="{}" />\n'.format(name))
+        f.write('        <initialState name="q0" />\n')
+        f.write('        <FinalStates numberOfFinalStates="{}">\n'.format(len(final_names)))
+        for name in final_names:
+            f.write('            <finalState name="{}" />\n'.format(name))
+        f.write('        </FinalStates>\n    </States>\n')
+        f.write('    <Transitions numberOfTrans="{}">\n'.format(n_transitions))
+        for index in range(n_transitions):
+            read = rng.choice(stack_names)
+            write = rng.choice(stack_names) + read if rng.random() < push_ratio else ''
+            f.write('        <transition name="tr{}" source="{}" destination="{}" input="{}" stackRead="{}" stackWrite="{}" />\n'.format(
+                index + 1, rng.choice(state_names), rng.choice(state_names),
+                'lambda' if rng.random() < 1 / 3 else rng.choice(input_names), read, write))
+        f.write('    </Transitions>\n</Automata>\n')
+
+    return file_name
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, or None where the
+    # resource module is missing (Windows)
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(file_name, render=True):
+    # One pass of the GUI pipeline: load the XML, convert it to the CFG text
+    # and pipe the diagram through Graphviz the way MainWindow.render_pda
+    # does. Runs in a fresh process so peak RSS belongs to this case only;
+    # peak RSS never decreases, so each phase reports the peak so far.
+    phases = {}
+
+    started = time.perf_counter()
+    pda = PDA(file_name)
+    phases['load'] = {'seconds': time.perf_counter() - started, 'peak_rss': peak_rss(),
+                      'output_size': os.path.getsize(file_name)}
+
+    started = time.perf_counter()
+    cfg = pda.convert_to_cfg()
+    phases['convert'] = {'seconds': time.perf_counter() - started, 'peak_rss': peak_rss(),
+                         'output_size': sum(len(line.encode()) + 1 for line in cfg), 'productions': len(cfg)}
+    del cfg
+
+    if render:
+        from graphviz import Source
+        started = time.perf_counter()
+        svg = Source(pda.to_dot(), format='svg').pipe(format='svg')
+        phases['render'] = {'seconds': time.perf_counter() - started, 'peak_rss': peak_rss(), 'output_size': len(svg)}
+
+    return phases
+
+
+def measure(file_name, repeat=1, render=True):
+    # Best wall time and highest peak RSS over repeat fresh processes
+    context = multiprocessing.get_context('spawn')
+    result = None
+    for _ in range(repeat):
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            phases = executor.submit(run_case, file_name, render).result()
+
+        if result is None:
+            result = phases
+            continue
+
+        for phase, metrics in phases.items():
+            best = result[phase]
+            best['seconds'] = min(best['seconds'], metrics['seconds'])
+            if metrics['peak_rss'] is not None:
+                best['peak_rss'] = max(best['peak_rss'], metrics['peak_rss'])
+
+    return result
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, density=4.0, push_ratio=0.5, input_symbols=2, stack_symbols=3,
+                   repeat=1, render=True, seed=0, log=None):
+    cases = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for states in sizes:
+            name = 'states={}'.format(states)
+            file_name = generate_pda(os.path.join(directory, 'pda_{}.xml'.format(states)), states, input_symbols,
+                                     stack_symbols, density, push_ratio, seed=seed)
+            cases[name] = measure(file_name, repeat, render)
+            if log:
+                log(name, cases[name])
+
+    return {
+        'version': BENCHMARK_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'density': density, 'push_ratio': push_ratio, 'input_symbols': input_symbols,
+                       'stack_symbols': stack_symbols, 'seed': seed},
+        'cases': cases
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    # (case, phase, metric, baseline, current) for every time or memory
+    # figure more than tolerance above the baseline, and for every output
+    # size that changed at all, since the generator is deterministic.
+    # Timings within TIMING_NOISE seconds of the baseline never count.
+    regressions = []
+    for case, phases in results['cases'].items():
+        for phase, metrics in phases.items():
+            old = baseline.get('cases', {}).get(case, {}).get(phase)
+            if old is None:
+                continue
+
+            for metric, noise in (('seconds', TIMING_NOISE), ('peak_rss', 0)):
+                if old.get(metric) and metrics.get(metric) and metrics[metric] - old[metric] > max(old[metric] * tolerance, noise):
+                    regressions.append((case, phase, metric, old[metric], metrics[metric]))
+            if phase != 'render' and old.get('output_size') != metrics.get('output_size'):
+                regressions.append((case, phase, 'output_size', old.get('output_size'), metrics.get('output_size')))
+
+    return regressions
+
+
+def format_metrics(metrics):
+    text = '{:.3f}s'.format(metrics['seconds'])
+    if metrics['peak_rss'] is not None:
+        text += ', peak {:.1f} MB'.format(metrics['peak_rss'] / (1 << 20))
+    return text + ', {} bytes out'.format(metrics['output_size'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python benchmark.py', description='Synthetic PDA generator and benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help='write a random PDA XML file')
+    generate.add_argument('output', help='XML file to write')
+    generate.add_argument('--states', type=int, default=10, help='number of states')
+    run = commands.add_parser('run', help='time load, convert and render on generated PDAs')
+    run.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='state counts to benchmark')
+    run.add_argument('--repeat', type=int, default=1, help='fresh processes per size; the best time is kept')
+    run.add_argument('--no-render', dest='render', action='store_false', help='skip the Graphviz rendering phase')
+    run.add_argument('-o', '--output', help='write the results as JSON to this file')
+    run.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    run.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    run.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown or growth (default: 0.25)')
+    for command in (generate, run):
+        command.add_argument('--input-symbols', type=int, default=2, help='input alphabet size')
+        command.add_argument('--stack-symbols', type=int, default=3, help='stack alphabet size, tail included')
+        command.add_argument('--density', type=float, default=4.0, help='transitions per state')
+        command.add_argument('--push-ratio', type=float, default=0.5, help='fraction of transitions that push')
+        command.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate_pda(args.output, args.states, args.input_symbols, args.stack_symbols, args.density,
+                     args.push_ratio, seed=args.seed)
+        return 0
+
+    def log(name, phases):
+        print(name)
+        for phase, metrics in phases.items():
+            print('    {}: {}'.format(phase, format_metrics(metrics)))
+
+    results = run_benchmarks(args.sizes, args.density, args.push_ratio, args.input_symbols, args.stack_symbols,
+                             args.repeat, args.render, args.seed, log)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('baseline saved to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline at {}; run with --save-baseline to record one'.format(args.baseline))
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('parameters') != results['parameters']:
+        print('warning: baseline was recorded with different parameters', file=sys.stderr)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for case, phase, metric, old, new in regressions:
+        print('REGRESSION {} {} {}: {} -> {}'.format(case, phase, metric, old, new))
+    print('{} regression(s) against {}'.format(len(regressions), args.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from array import array
+from pda import PDA, COMPILED_VERSION, CONVERTER_VERSION, ProductionTable, load
+
+
+DEFAULT_MAX_SIZE = 1 << 30
+
+
+class PDACache:
+    # Content-addressed cache of compiled PDAs and generated grammars. Entries
+    # are named after a hash of the XML bytes and the converter version, are
+    # published with an atomic rename and touched on every hit, so several
+    # processes can share a directory without locking; eviction drops the
+    # least recently used entries once the directory exceeds max_size bytes.
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory or os.environ.get('PDA_CACHE_DIR') or os.path.join(
+            os.path.expanduser('~'), '.cache', 'pdatocfg')
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    def key(self, file_name):
+        digest = hashlib.sha256('{}:{}:'.format(CONVERTER_VERSION, COMPILED_VERSION).encode())
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+
+    def lookup(self, key, suffix):
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+
+        return path
+
+
+    def store(self, key, suffix, write):
+        # Path of the stored entry, or None when it is larger than max_size
+        # and so not cached at all. Errors from write propagate.
+        path = self.path(key, suffix)
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(temp_name)
+            if os.path.getsize(temp_name) > self.max_size:
+                return None
+
+            try:
+                os.replace(temp_name, path)
+            except OSError:
+                # Another process won the race (or holds the entry open on
+                # Windows); its copy is identical, so keep that one.
+                pass
+        finally:
+            if os.path.exists(temp_name):
+                os.unlink(temp_name)
+
+        self.evict(keep=path)
+        return path
+
+
+    def load(self, file_name, metrics=None):
+        key = self.key(file_name)
+        path = self.lookup(key, '.pdac')
+        pda = None
+
+        if path is not None:
+            try:
+                pda = PDA.from_compiled(path, metrics)
+            except Exception:
+                pda = None
+
+        if pda is None:
+            pda = load(file_name, metrics)
+            self.store(key, '.pdac', pda.save_compiled)
+
+        pda.file_name = file_name
+        pda.cache_key = key
+        return pda
+
+
+    @staticmethod
+    def cfg_suffix(pda, prune):
+        suffix = '.pruned.cfg' if prune else '.cfg'
+        return suffix if pda.acceptance == 'empty' else '.' + pda.acceptance + suffix
+
+
+    def write_cfg_file(self, pda, file_name, prune=False, workers=1):
+        # Writes the grammar text to file_name, copied from the cache on a
+        # hit, else generated there (by `workers` processes, see
+        # PDA.write_cfg_parallel) and then stored; an entry evicted by
+        # another process after the lookup counts as a miss
+        key = getattr(pda, 'cache_key', None)
+        suffix = self.cfg_suffix(pda, prune)
+        path = key and self.lookup(key, suffix)
+        if path:
+            try:
+                shutil.copyfile(path, file_name)
+                return
+            except FileNotFoundError:
+                pass
+
+        if workers > 1:
+            pda.write_cfg_parallel(file_name, workers, prune)
+        else:
+            with open(file_name, 'w', encoding='utf-8') as output:
+                pda.write_cfg(output, prune=prune)
+        if key:
+            self.store(key, suffix, lambda temp_name: shutil.copyfile(file_name, temp_name))
+
+
+    @classmethod
+    def table_suffix(cls, pda, prune):
+        return cls.cfg_suffix(pda, prune)[:-len('.cfg')] + '.pcfg'
+
+
+    def cached_table(self, pda, prune=False):
+        # ProductionTable stored by store_table, or None
+        key = getattr(pda, 'cache_key', None)
+        path = key and self.lookup(key, self.table_suffix(pda, prune))
+        if not path:
+            return None
+
+        from export import load_binary
+
+        try:
+            _, records = load_binary(path)
+        except Exception:
+            return None
+
+        table = ProductionTable(pda, 0)
+        for offset, column in enumerate(('head', 'terminal', 'left', 'right')):
+            setattr(table, column, array('l', records[offset::4]))
+        return table
+
+
+    def store_table(self, pda, table, prune=False):
+        # Production records as a binary export, so a later conversion of the
+        # same file is a cache hit without formatting any text
+        key = getattr(pda, 'cache_key', None)
+        if key is None:
+            return None
+
+        from export import write_binary
+
+        def write(temp_name):
+            with open(temp_name, 'wb') as output:
+                write_binary(pda, output, table)
+
+        return self.store(key, self.table_suffix(pda, prune), write)
+
+
+    def evict(self, keep=None):
+        # Drops least recently used entries, never keep (the entry just stored)
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        if total <= self.max_size:
+            return
+
+        for _, size, path in sorted(entries):
+            if path == keep:
+                continue
+
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+
+            total -= size
+            if total <= self.max_size:
+                break
@@ -0,0 +1,262 @@
+import gzip
+import json
+import os
+import re
+import struct
+import sys
+from array import array
+from itertools import chain, islice
+from pda import LAMBDA, NONE, CompactFormatter, NonterminalTable, write_lines
+
+
+EXPORT_FORMATS = {'text': '.cfg', 'binary': '.pcfg', 'bnf': '.bnf', 'lark': '.lark', 'antlr': '.g4'}
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+GRAMMAR_MAGIC = b'PCFG'
+GRAMMAR_VERSION = 1
+GRAMMAR_HEADER = struct.Struct('<4sIIQ')
+BATCH_SIZE = 1 << 16
+
+
+def compression_for(file_name):
+    # Compression implied by the file name suffix, or None
+    for compression, suffix in COMPRESSIONS.items():
+        if file_name.endswith(suffix):
+            return compression
+    return None
+
+
+def open_output(file_name, compression=None):
+    # Binary stream for an export; writes go through write_lines or bulk
+    # array writes, so no extra buffering layer is added on top
+    if compression is None:
+        return open(file_name, 'wb')
+    if compression == 'gzip':
+        return gzip.open(file_name, 'wb', compresslevel=6)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception('zstd compression needs the zstandard package')
+        return zstandard.ZstdCompressor().stream_writer(open(file_name, 'wb'))
+
+    raise Exception('Unknown compression: "{}"'.format(compression))
+
+
+def open_input(file_name):
+    compression = compression_for(file_name)
+    if compression == 'gzip':
+        return gzip.open(file_name, 'rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception('zstd compression needs the zstandard package')
+        return zstandard.ZstdDecompressor().stream_reader(open(file_name, 'rb'))
+
+    return open(file_name, 'rb')
+
+
+def start_records(pda, prune=False, analysis=None):
+    # Productions of the single start symbol: part of the records in final
+    # mode, made up from the start triples in empty mode
+    if pda.acceptance == 'final':
+        return []
+    return list(pda.iter_start_productions(prune, analysis, force=True))
+
+
+def legend_name(file_name):
+    compression = compression_for(file_name)
+    if compression is not None:
+        file_name = file_name[:-len(COMPRESSIONS[compression])]
+    return file_name + '.legend'
+
+
+def export_grammar(pda, file_name, output_format='binary', prune=False, compression=None, table=None,
+                   names='triples'):
+    # Writes the grammar of pda straight from its production records, or
+    # from table (e.g. a simplified ProductionTable) when given, and returns
+    # the number of productions written. compression defaults to what the
+    # file name suffix implies. Text keeps the (pAq) names unless names is
+    # 'compact'; BNF, Lark and ANTLR always use the short NonterminalTable
+    # names. Either way the names are listed in a legend file next to the
+    # output, see legend_name.
+    if output_format not in EXPORT_FORMATS:
+        raise Exception('Unknown export format: "{}"'.format(output_format))
+
+    analysis = pda.analyze() if prune and table is None else None
+    records = table if table is not None else pda.iter_productions(prune, analysis=analysis)
+    if compression is None:
+        compression = compression_for(file_name)
+    nonterminals = None
+
+    with open_output(file_name, compression) as output:
+        if output_format == 'binary':
+            count = write_binary(pda, output, records)
+        elif output_format == 'text':
+            formatter = None
+            if names == 'compact':
+                nonterminals = NonterminalTable(pda)
+                formatter = CompactFormatter(pda, nonterminals)
+            if table is not None:
+                count = table.write(output, formatter=formatter)
+            else:
+                count = write_lines(output, pda.iter_cfg(prune, formatter=formatter))
+        else:
+            nonterminals = NonterminalTable(pda, 'n', 'start')
+            records = chain(start_records(pda, prune and table is None, analysis), records)
+            if output_format == 'bnf':
+                count = write_bnf(pda, output, records, nonterminals)
+            elif output_format == 'lark':
+                count = write_lark(pda, output, records, nonterminals)
+            else:
+                count = write_antlr(pda, output, records, nonterminals, grammar_name(file_name))
+
+    if nonterminals is not None:
+        with open(legend_name(file_name), 'w', encoding='utf-8') as legend:
+            nonterminals.write_legend(legend)
+    return count
+
+
+def write_binary(pda, output, records):
+    # Layout: header (magic, version, id width in bytes, metadata length),
+    # JSON metadata with the symbol tables and everything needed to decode
+    # nonterminal ids, padded to 8 bytes, then one record of four
+    # little-endian signed ids (head, terminal, left, right) per production
+    # up to the end of the stream. Ids are int32 unless the grammar needs more.
+    trs = pda.transitions
+    n_ids = pda.start_symbol() + 1
+    code = 'i' if n_ids < 1 << 31 else 'q'
+    width = array(code).itemsize
+    meta = json.dumps({
+        'states': pda.state_table.names,
+        'stack': pda.stack_table.names,
+        'inputs': pda.input_table.names,
+        'n_states': len(pda.state_table),
+        'n_stack': len(pda.stack_table),
+        'chains': [[destination, list(prefix)] for destination, prefix in trs.chains],
+        'start': pda.start_symbols(),
+        'acceptance': pda.acceptance
+    }).encode()
+    meta += b' ' * (-(GRAMMAR_HEADER.size + len(meta)) % 8)
+    output.write(GRAMMAR_HEADER.pack(GRAMMAR_MAGIC, GRAMMAR_VERSION, width, len(meta)))
+    output.write(meta)
+
+    count = 0
+    records = iter(records)
+    while True:
+        batch = list(islice(records, BATCH_SIZE))
+        if not batch:
+            return count
+
+        data = array(code, chain.from_iterable(batch))
+        if sys.byteorder != 'little':
+            data.byteswap()
+        output.write(data.tobytes())
+        count += len(batch)
+
+
+def load_binary(file_name):
+    # (metadata, records) of a binary export; records is a flat array with
+    # production i at [4 * i:4 * i + 4]
+    with open_input(file_name) as f:
+        data = f.read()
+
+    magic, version, width, meta_length = GRAMMAR_HEADER.unpack_from(data)
+    if magic != GRAMMAR_MAGIC:
+        raise Exception('Not a binary grammar file: "{}"'.format(file_name))
+    if version != GRAMMAR_VERSION:
+        raise Exception('Unsupported binary grammar version {} in "{}"'.format(version, file_name))
+
+    offset = GRAMMAR_HEADER.size
+    meta = json.loads(data[offset:offset + meta_length])
+    records = array('i' if width == 4 else 'q')
+    records.frombytes(data[offset + meta_length:])
+    if sys.byteorder != 'little':
+        records.byteswap()
+    return meta, records
+
+
+def write_bnf(pda, output, records, nonterminals):
+    # One rule per production, so the grammar streams in record order; a
+    # nonterminal with several productions has several rules
+    name = nonterminals.name
+    terminals = [json.dumps(terminal, ensure_ascii=False) for terminal in pda.input_table.names]
+
+    def lines():
+        for head, terminal, left, right in records:
+            line = '<' + name(head) + '> ::= '
+            body = [] if terminal == LAMBDA else [terminals[terminal]]
+            if left != NONE:
+                body.append('<' + name(left) + '>')
+                if right != NONE:
+                    body.append('<' + name(right) + '>')
+            yield line + (' '.join(body) or '""')
+
+    return write_lines(output, lines())
+
+
+def grouped_rules(pda, records):
+    # Parser generators reject rules that are used but never defined and
+    # rules defined twice, so these formats get the useless productions
+    # removed and one rule per head, alternatives in record order
+    from grammar import remove_useless, rules_from_records
+
+    rules = remove_useless(rules_from_records(records), [pda.start_symbol()])
+    if not rules:
+        raise Exception('The grammar derives no words')
+
+    by_head = {}
+    for head, terminal, body in rules:
+        by_head.setdefault(head, []).append((terminal, body))
+    return by_head
+
+
+def write_lark(pda, output, records, nonterminals):
+    name = nonterminals.name
+    terminals = [json.dumps(terminal, ensure_ascii=False) for terminal in pda.input_table.names]
+
+    def alternative(terminal, body):
+        return ' '.join(([] if terminal == LAMBDA else [terminals[terminal]]) + [name(symbol) for symbol in body])
+
+    def rules(by_head):
+        for head, alternatives in by_head.items():
+            yield '{}: {}'.format(name(head), '\n    | '.join(alternative(*item) for item in alternatives))
+
+    by_head = grouped_rules(pda, records)
+    write_lines(output, rules(by_head))
+    return sum(len(alternatives) for alternatives in by_head.values())
+
+
+def antlr_literal(text):
+    return "'" + text.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def grammar_name(file_name):
+    # ANTLR wants the grammar named after its file
+    stem = os.path.basename(file_name)
+    while '.' in stem:
+        stem = os.path.splitext(stem)[0]
+    stem = re.sub(r'\W', '_', stem, flags=re.ASCII)
+    return stem if re.match(r'[A-Za-z]', stem) else 'G' + stem
+
+
+def write_antlr(pda, output, records, nonterminals, name='Grammar'):
+    symbol = nonterminals.name
+    terminals = [antlr_literal(terminal) for terminal in pda.input_table.names]
+
+    def alternative(terminal, body):
+        return ' '.join(([] if terminal == LAMBDA else [terminals[terminal]]) + [symbol(item) for item in body])
+
+    def rules(by_head):
+        yield 'grammar {};'.format(name)
+        yield ''
+        # The start rule has to match the whole input
+        yield 'file : start EOF ;'
+        for head, alternatives in by_head.items():
+            yield ''
+            yield '{}\n    : {}\n    ;'.format(symbol(head), '\n    | '.join(alternative(*item) for item in alternatives))
+
+    by_head = grouped_rules(pda, records)
+    write_lines(output, rules(by_head))
+    return sum(len(alternatives) for alternatives in by_head.values())
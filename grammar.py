@@ -0,0 +1,493 @@
+from itertools import product
+from pda import LAMBDA, NONE, ProductionTable, load_numpy
+
+
+CYK_MAX_LENGTH = 64
+# Largest packed CYK table cyk_numpy allocates, in bytes; bigger grammars use
+# the Python int bitsets, which only hold the nonterminals actually derived
+CYK_MAX_TABLE_SIZE = 1 << 27
+
+
+class CompiledGrammar:
+    # A grammar in Chomsky normal form over dense nonterminal ids, compiled
+    # from production records by compile_grammar. terminal_rules holds
+    # (head, terminal id) pairs and binary_rules (head, left, right) triples;
+    # the empty word is covered by start_nullable instead of a λ-rule.
+    def __init__(self, n_nonterminals, start, start_nullable, terminal_rules, binary_rules, terminal_ids):
+        self.n_nonterminals = n_nonterminals
+        self.start = start
+        self.start_nullable = start_nullable
+        self.terminal_ids = terminal_ids
+        self.terminal_rules = sorted(terminal_rules)
+        self.binary_rules = sorted(binary_rules)
+
+        self.terminal_heads = {}
+        self.terminal_masks = {}
+        for head, terminal in self.terminal_rules:
+            self.terminal_heads.setdefault(terminal, []).append(head)
+            self.terminal_masks[terminal] = self.terminal_masks.get(terminal, 0) | 1 << head
+
+        self.rules_by_head = {}
+        self.rules_by_left = {}
+        for head, left, right in self.binary_rules:
+            self.rules_by_head.setdefault(head, []).append((left, right))
+            self.rules_by_left.setdefault(left, []).append((right, 1 << head))
+
+        np = load_numpy()
+        if np is not None:
+            rules = np.array(self.binary_rules, dtype=np.int64).reshape(-1, 3)
+            self.rule_head = rules[:, 0].copy()
+            # Byte and bit of each rule's left and right symbol in a packed cell
+            self.rule_left_byte = rules[:, 1] >> 3
+            self.rule_left_bit = (1 << (rules[:, 1] & 7)).astype(np.uint8)
+            self.rule_right_byte = rules[:, 2] >> 3
+            self.rule_right_bit = (1 << (rules[:, 2] & 7)).astype(np.uint8)
+
+
+    @classmethod
+    def from_pda(cls, pda, prune=True, acceptance='empty'):
+        pda = pda.with_acceptance(acceptance)
+        return compile_grammar(pda.productions(prune), pda.start_triples(), pda.input_table.ids)
+
+
+    def accepts(self, word, cyk_max_length=CYK_MAX_LENGTH):
+        symbols = [self.terminal_ids.get(symbol, NONE) for symbol in word]
+        if NONE in symbols:
+            return False
+        if not symbols:
+            return self.start_nullable
+        if len(symbols) <= cyk_max_length:
+            return self.cyk(symbols)
+
+        return self.earley(symbols)
+
+
+    def run(self, words, cyk_max_length=CYK_MAX_LENGTH):
+        return [self.accepts(word, cyk_max_length) for word in words]
+
+
+    def cyk(self, symbols):
+        n = len(symbols)
+        if load_numpy() is not None and n * (n + 1) * ((self.n_nonterminals + 7) >> 3) <= CYK_MAX_TABLE_SIZE:
+            return self.cyk_numpy(symbols)
+
+        # table[i][j] is the bitset of nonterminals deriving symbols[i:j]
+        rules_by_left = self.rules_by_left
+        table = [[0] * (n + 1) for _ in range(n)]
+        for i, symbol in enumerate(symbols):
+            table[i][i + 1] = self.terminal_masks.get(symbol, 0)
+
+        for span in range(2, n + 1):
+            for i in range(n - span + 1):
+                j = i + span
+                row = table[i]
+                mask = 0
+                for k in range(i + 1, j):
+                    left = row[k]
+                    right = table[k][j]
+                    if not left or not right:
+                        continue
+
+                    while left:
+                        low = left & -left
+                        left ^= low
+                        for right_symbol, head in rules_by_left.get(low.bit_length() - 1, ()):
+                            if right >> right_symbol & 1:
+                                mask |= head
+
+                row[j] = mask
+
+        return bool(table[0][n] >> self.start & 1)
+
+
+    def cyk_numpy(self, symbols):
+        # Same table as cyk with the nonterminals of each cell packed into
+        # N / 8 bytes, bit h & 7 of byte h >> 3 for nonterminal h; each cell
+        # tests every binary rule against all of its split points at once.
+        np = load_numpy()
+        n = len(symbols)
+        table = np.zeros((n, n + 1, (self.n_nonterminals + 7) >> 3), dtype=np.uint8)
+        cell = np.zeros(self.n_nonterminals, dtype=bool)
+        for i, symbol in enumerate(symbols):
+            cell[:] = False
+            cell[self.terminal_heads.get(symbol, [])] = True
+            table[i, i + 1] = np.packbits(cell, bitorder='little')
+
+        for span in range(2, n + 1):
+            for i in range(n - span + 1):
+                j = i + span
+                left = table[i, i + 1:j]
+                right = table[i + 1:j, j]
+                hits = ((left[:, self.rule_left_byte] & self.rule_left_bit) != 0) & \
+                    ((right[:, self.rule_right_byte] & self.rule_right_bit) != 0)
+                cell[:] = False
+                cell[self.rule_head[hits.any(axis=0)]] = True
+                table[i, j] = np.packbits(cell, bitorder='little')
+
+        return bool(table[0, n, self.start >> 3] >> (self.start & 7) & 1)
+
+
+    def earley(self, symbols):
+        # Earley recognition specialised to CNF: no λ-rules, so an item
+        # A → B . C only waits on C at the position where B ended.
+        n = len(symbols)
+        terminal_heads = {terminal: set(heads) for terminal, heads in self.terminal_heads.items()}
+        predicted = [set() for _ in range(n + 1)]
+        waiting = [{} for _ in range(n + 1)]
+        pending = [[] for _ in range(n + 1)]
+
+        def predict(nonterminal, i):
+            stack = [nonterminal]
+            heads = terminal_heads.get(symbols[i], ()) if i < n else ()
+            while stack:
+                nonterminal = stack.pop()
+                if nonterminal in predicted[i]:
+                    continue
+
+                predicted[i].add(nonterminal)
+                if nonterminal in heads:
+                    pending[i + 1].append((nonterminal, i))
+                for left, right in self.rules_by_head.get(nonterminal, ()):
+                    waiting[i].setdefault(left, []).append((nonterminal, right, i))
+                    stack.append(left)
+
+        predict(self.start, 0)
+        done = set()
+        for j in range(1, n + 1):
+            worklist = pending[j]
+            done = set()
+            while worklist:
+                completed = worklist.pop()
+                if completed in done:
+                    continue
+
+                done.add(completed)
+                nonterminal, origin = completed
+                for head, right, head_origin in waiting[origin].get(nonterminal, ()):
+                    if right == NONE:
+                        worklist.append((head, head_origin))
+                    else:
+                        waiting[j].setdefault(right, []).append((head, NONE, head_origin))
+                        predict(right, j)
+
+        return (self.start, 0) in done
+
+
+def compile_grammar(productions, start, terminal_ids):
+    # productions are (head, terminal, left, right) records as produced by
+    # PDA.iter_productions, start the nonterminal ids the language is derived
+    # from. Nullable symbols are expanded out, terminals inside longer bodies
+    # get preterminals, bodies are binarised through shared pair
+    # nonterminals and unit rules are folded into their heads.
+    ids = {}
+
+    def dense(symbol):
+        symbol_id = ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = ids[symbol] = len(ids)
+        return symbol_id
+
+    rules = [(dense(head), terminal, tuple(dense(symbol) for symbol in (left, right) if symbol != NONE))
+             for head, terminal, left, right in productions]
+    start = [dense(symbol) for symbol in start]
+    nullable = derivable(rules, True)
+    counter = [len(ids)]
+
+    def new_nonterminal():
+        counter[0] += 1
+        return counter[0] - 1
+
+    terminal_rules = set()
+    binary_rules = set()
+    units = {}
+    preterminals = {}
+    pairs = {}
+
+    def preterminal(terminal):
+        if terminal not in preterminals:
+            preterminals[terminal] = new_nonterminal()
+            terminal_rules.add((preterminals[terminal], terminal))
+        return preterminals[terminal]
+
+    def pair(left, right):
+        if (left, right) not in pairs:
+            pairs[left, right] = new_nonterminal()
+            binary_rules.add((pairs[left, right], left, right))
+        return pairs[left, right]
+
+    for head, terminal, body in rules:
+        choices = [((symbol,), ()) if symbol in nullable else ((symbol,),) for symbol in body]
+        for variant in set(sum(parts, ()) for parts in product(*choices)):
+            if terminal != LAMBDA:
+                if not variant:
+                    terminal_rules.add((head, terminal))
+                    continue
+                variant = (preterminal(terminal),) + variant
+
+            if len(variant) == 1:
+                units.setdefault(head, set()).add(variant[0])
+            elif len(variant) > 1:
+                while len(variant) > 2:
+                    variant = variant[:-2] + (pair(variant[-2], variant[-1]),)
+                binary_rules.add((head,) + variant)
+
+    start_symbol = new_nonterminal()
+    units[start_symbol] = set(start)
+
+    terminals_by_head = {}
+    for head, terminal in terminal_rules:
+        terminals_by_head.setdefault(head, []).append(terminal)
+    binaries_by_head = {}
+    for head, left, right in binary_rules:
+        binaries_by_head.setdefault(head, []).append((left, right))
+
+    for head in list(units):
+        reached = {head}
+        stack = [head]
+        while stack:
+            for target in units.get(stack.pop(), ()):
+                if target not in reached:
+                    reached.add(target)
+                    stack.append(target)
+
+        for target in reached - {head}:
+            terminal_rules.update((head, terminal) for terminal in terminals_by_head.get(target, ()))
+            binary_rules.update((head, left, right) for left, right in binaries_by_head.get(target, ()))
+
+    start_nullable = any(symbol in nullable for symbol in start)
+    return CompiledGrammar(counter[0], start_symbol, start_nullable, terminal_rules, binary_rules, terminal_ids)
+
+
+def derivable(rules, lambda_only=False):
+    # Worklist over (head, terminal, body) rules: each rule keeps a count of
+    # body symbols not yet derived and fires its head when that reaches
+    # zero. Returns the generating nonterminals, or with lambda_only the
+    # nullable ones (rules with a terminal never fire).
+    occurrences = {}
+    remaining = []
+    worklist = []
+    found = set()
+
+    for index, (head, terminal, body) in enumerate(rules):
+        if lambda_only and terminal != LAMBDA:
+            remaining.append(-1)
+            continue
+
+        remaining.append(len(body))
+        for symbol in body:
+            occurrences.setdefault(symbol, []).append(index)
+        if not body:
+            worklist.append(head)
+
+    while worklist:
+        symbol = worklist.pop()
+        if symbol in found:
+            continue
+
+        found.add(symbol)
+        for index in occurrences.get(symbol, ()):
+            if remaining[index] > 0:
+                remaining[index] -= 1
+                if remaining[index] == 0:
+                    worklist.append(rules[index][0])
+
+    return found
+
+
+def rules_from_records(records):
+    return [(head, terminal, tuple(symbol for symbol in (left, right) if symbol != NONE))
+            for head, terminal, left, right in records]
+
+
+def remove_useless(rules, start):
+    generating = derivable(rules)
+    rules = [rule for rule in rules if rule[0] in generating and all(symbol in generating for symbol in rule[2])]
+
+    by_head = {}
+    for rule in rules:
+        by_head.setdefault(rule[0], []).append(rule)
+
+    reachable = set()
+    stack = [symbol for symbol in start if symbol in generating]
+    while stack:
+        symbol = stack.pop()
+        if symbol in reachable:
+            continue
+
+        reachable.add(symbol)
+        for _, _, body in by_head.get(symbol, ()):
+            stack.extend(body)
+
+    return [rule for rule in rules if rule[0] in reachable]
+
+
+def remove_lambda(rules):
+    nullable = derivable(rules, True)
+    result = []
+    for head, terminal, body in rules:
+        choices = [((symbol,), ()) if symbol in nullable else ((symbol,),) for symbol in body]
+        for variant in sorted(set(sum(parts, ()) for parts in product(*choices)), key=len, reverse=True):
+            if terminal != LAMBDA or variant:
+                result.append((head, terminal, variant))
+
+    return list(dict.fromkeys(result)), nullable
+
+
+def unit_components(units):
+    # Strongly connected components of the unit graph (iterative Tarjan), in
+    # reverse topological order: a component comes after every one it reaches.
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    for root in units:
+        if root in index:
+            continue
+
+        work = [(root, iter(units.get(root, ())))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(units.get(child, ()))))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+def remove_units(rules, start=()):
+    # Symbols on a cycle of unit productions derive the same words, so each
+    # cycle collapses into one representative (a start symbol if it holds
+    # one). The remaining unit A → B is replaced by the productions of B only
+    # where that can't grow the grammar: B has a single production, or A → B
+    # is the only use of B and B's productions move into A. Other units stay.
+    start = list(start)
+    units = {}
+    for head, terminal, body in rules:
+        if terminal == LAMBDA and len(body) == 1 and body[0] != head:
+            units.setdefault(head, []).append(body[0])
+
+    representative = {}
+    components = unit_components(units)
+    for component in components:
+        if len(component) > 1:
+            starts = [symbol for symbol in start if symbol in component]
+            chosen = starts[0] if starts else min(component)
+            for symbol in component:
+                representative[symbol] = chosen
+
+    def rename(symbol):
+        return representative.get(symbol, symbol)
+
+    by_head = {}
+    for head, terminal, body in rules:
+        head = rename(head)
+        body = tuple(rename(symbol) for symbol in body)
+        if terminal != LAMBDA or body != (head,):
+            by_head.setdefault(head, {})[terminal, body] = None
+    for symbol in start:
+        if rename(symbol) != symbol:
+            # A start symbol merged into another one keeps deriving it
+            by_head.setdefault(symbol, {})[LAMBDA, (rename(symbol),)] = None
+
+    uses = {}
+    for productions in by_head.values():
+        for _, body in productions:
+            for symbol in body:
+                uses[symbol] = uses.get(symbol, 0) + 1
+
+    starts = set(start)
+    for component in components:
+        productions = by_head.get(rename(component[0]))
+        if productions is None:
+            continue
+
+        # Targets come earlier in components, so their units are settled
+        pending = [body[0] for terminal, body in productions if terminal == LAMBDA and len(body) == 1]
+        while pending:
+            target = pending.pop()
+            if (LAMBDA, (target,)) not in productions:
+                continue
+
+            targets = by_head.get(target, {})
+            if len(targets) == 1:
+                moved = list(targets)
+                for symbol in moved[0][1]:
+                    uses[symbol] = uses.get(symbol, 0) + 1
+            elif uses.get(target) == 1 and target not in starts:
+                moved = list(by_head.pop(target, {}))
+            else:
+                continue
+
+            del productions[LAMBDA, (target,)]
+            uses[target] -= 1
+            for production in moved:
+                if production in productions:
+                    for symbol in production[1]:
+                        uses[symbol] -= 1
+                    continue
+
+                productions[production] = None
+                if production[0] == LAMBDA and len(production[1]) == 1:
+                    pending.append(production[1][0])
+
+    return [(head, terminal, body) for head, productions in by_head.items() for terminal, body in productions]
+
+
+def simplify(table, start):
+    # Removes useless symbols, λ-productions and unit productions from a
+    # ProductionTable, then useless symbols again, and is never larger than
+    # the grammar without useless symbols. The result derives the same
+    # language minus the empty word where `nullable` is set, the same
+    # language otherwise. report lists (stage, productions before, after).
+    start = list(start)
+    rules = rules_from_records(table)
+    report = []
+
+    def stage(name, result):
+        report.append((name, len(rules), len(result)))
+        return result
+
+    rules = pruned = stage('useless', remove_useless(rules, start))
+    result, nullable_symbols = remove_lambda(rules)
+    rules = stage('lambda', result)
+    rules = stage('unit', remove_units(rules, start))
+    rules = stage('useless', remove_useless(rules, start))
+    nullable = any(symbol in nullable_symbols for symbol in start)
+    if len(rules) > len(pruned):
+        # λ-elimination can still outgrow what the unit stage saves; the
+        # grammar without useless symbols is smaller then, and keeps its
+        # own λ-productions, so the empty word was not removed after all
+        rules = stage('fallback', pruned)
+        nullable = False
+
+    simplified = ProductionTable(table.pda, len(rules))
+    for index, (head, terminal, body) in enumerate(rules):
+        body = body + (NONE,) * (2 - len(body))
+        simplified.head[index] = head
+        simplified.terminal[index] = terminal
+        simplified.left[index], simplified.right[index] = body
+
+    return simplified, nullable, report
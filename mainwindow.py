@@ -1,10 +1,161 @@
 import sys
-from pda import PDA
-from graphviz import Digraph
-from PyQt5 import QtCore, QtGui, QtWidgets, QtSvg
-import tempfile
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+import difflib
+from pda import PDA, IncrementalCFG, ProductionFormatter, ProductionTable, load_numpy, write_lines
+from metrics import Metrics, format_metrics
+from collections import OrderedDict
+from PyQt5 import QtCore, QtGui, QtWidgets
+# QtSvg, graphviz, the cache and the XML writers are imported on first use
+# so the welcome screen paints before any of them load
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QtCore.QObject):
+    # progress carries (transitions processed, productions emitted); results
+    # travel as object references, so nothing is copied back to the UI thread
+    progress = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+
+class Worker(QtCore.QRunnable):
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.signals = WorkerSignals()
+        self.cancelled = False
+        # Subprocess the job waits on, killed when the job is cancelled
+        self.process = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.process is not None:
+            self.process.kill()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def run(self):
+        try:
+            result = self.job(self)
+        except Cancelled:
+            return
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit(str(e))
+            return
+
+        if not self.cancelled:
+            self.signals.finished.emit(result)
+
+
+def convert_job(pda, cache, incremental, chunk_size=256):
+    def job(worker):
+        def progress(transitions, productions):
+            worker.check()
+            worker.signals.progress.emit(transitions, productions)
+
+        if incremental is not None and incremental.pda is pda:
+            lines = list(incremental.lines(progress, chunk_size))
+            worker.signals.progress.emit(len(pda.transitions), len(lines))
+            return lines
+
+        table = cache.cached_table(pda)
+        if table is not None:
+            if pda.metrics is not None:
+                pda.metrics.count('cached conversions')
+            worker.signals.progress.emit(len(pda.transitions), len(table))
+            return table
+
+        table = production_table(pda, progress, chunk_size)
+        try:
+            cache.store_table(pda, table)
+        except OSError:
+            # A cache that can't be written only costs the next conversion
+            pass
+        return table
+
+    return job
+
+
+def incremental_job(pda):
+    def job(worker):
+        def progress(transitions):
+            worker.check()
+            worker.signals.progress.emit(transitions, 0)
+
+        return IncrementalCFG(pda, progress)
+
+    return job
+
+
+def production_table(pda, progress, chunk_size):
+    # Integer records only; the viewer renders rows as they are shown.
+    # progress checks for cancellation between chunks of transitions.
+    trs = pda.transitions
+    if load_numpy() is not None:
+        with pda.phase('productions'):
+            table = pda.vectorized_productions(progress, chunk_size)
+        progress(len(trs), len(table))
+        if pda.metrics is not None:
+            pda.metrics.count('productions emitted', len(table))
+        return table
+
+    table = ProductionTable(pda, pda.count_productions())
+    head, terminal, left, right = table.head, table.terminal, table.left, table.right
+    index = 0
+    with pda.phase('productions'):
+        for start in range(0, len(trs), chunk_size):
+            stop = min(start + chunk_size, len(trs))
+            for production in pda.iter_productions(transitions=range(start, stop)):
+                head[index], terminal[index], left[index], right[index] = production
+                index += 1
+            progress(stop, index)
+        for production in pda.iter_chain_productions():
+            head[index], terminal[index], left[index], right[index] = production
+            index += 1
+
+    if pda.metrics is not None:
+        pda.metrics.count('productions emitted', index)
+    return table
+
+
+# Rendered SVGs keyed by a hash of their DOT source, most recent last
+SVG_CACHE = OrderedDict()
+SVG_CACHE_SIZE = 32
+
+# Save dialog filters of the grammar export formats, see export.export_grammar
+EXPORT_FILTERS = {
+    'Binary grammar (*.pcfg *.pcfg.gz)': 'binary',
+    'BNF (*.bnf *.bnf.gz)': 'bnf',
+    'Lark grammar (*.lark)': 'lark',
+    'ANTLR grammar (*.g4)': 'antlr',
+}
+
+
+def render_job(source, pda):
+    # dot runs as a child process of its own, so cancelling the job kills it
+    # instead of leaving it to finish on a pool thread
+    def job(worker):
+        import subprocess
+
+        worker.check()
+        with pda.phase('render'):
+            worker.process = subprocess.Popen([source.engine, '-Tsvg'], stdin=subprocess.PIPE,
+                                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if worker.cancelled:
+                worker.process.kill()
+            svg, errors = worker.process.communicate(source.source.encode(source.encoding or 'utf-8'))
+            worker.check()
+            if worker.process.returncode != 0:
+                raise Exception(errors.decode(errors='replace').strip() or
+                                f"{source.engine} exited with code {worker.process.returncode}")
+            return svg
+
+    return job
 
 
 # Add the PDADialog class before MainWindow class
@@ -26,20 +177,16 @@ class PDADialog(QtWidgets.QDialog):
         
         self.tabs = QtWidgets.QTabWidget()
         
-        # States Tab
+        # Tabs start empty and are filled in the first time they are shown
         self.states_tab = QtWidgets.QWidget()
-        self.setup_states_tab()
         self.tabs.addTab(self.states_tab, "States")
-        
-        # Alphabets Tab
         self.alphabets_tab = QtWidgets.QWidget()
-        self.setup_alphabets_tab()
         self.tabs.addTab(self.alphabets_tab, "Alphabets")
-        
-        # Transitions Tab
         self.transitions_tab = QtWidgets.QWidget()
-        self.setup_transitions_tab()
         self.tabs.addTab(self.transitions_tab, "Transitions")
+        self.tab_setups = {0: self.setup_states_tab, 1: self.setup_alphabets_tab, 2: self.setup_transitions_tab}
+        self.tabs.currentChanged.connect(self.build_tab)
+        self.build_tab(0)
         
         self.button_box = QtWidgets.QDialogButtonBox(
             QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
@@ -52,6 +199,15 @@ class PDADialog(QtWidgets.QDialog):
         layout.addWidget(self.button_box)
         self.setLayout(layout)
 
+    def build_tab(self, index):
+        setup = self.tab_setups.pop(index, None)
+        if setup is not None:
+            setup()
+
+    def build_all_tabs(self):
+        for index in list(self.tab_setups):
+            self.build_tab(index)
+
     def setup_states_tab(self):
         layout = QtWidgets.QVBoxLayout()
 
@@ -209,7 +365,44 @@ class PDADialog(QtWidgets.QDialog):
         if current_row >= 0:
             self.transition_table.removeRow(current_row)
 
+    def load_pda(self, pda):
+        # Prefill every tab from an existing PDA so it can be edited
+        self.build_all_tabs()
+        for state in pda.state_table.names:
+            if state in pda.states:
+                self.new_state_input.setText(state)
+                self.add_state()
+        for radio in self.initial_radio_group.buttons():
+            radio.setChecked(radio.text() == pda.initial_state)
+        for checkbox in self.final_checkboxes:
+            checkbox.setChecked(checkbox.text() in pda.final_states)
+
+        for letter in pda.input_table.names:
+            if letter in pda.input_alphabets:
+                self.input_alpha_input.setText(letter)
+                self.add_alphabet('input')
+        for letter in pda.stack_table.names:
+            if letter in pda.stack_alphabets or letter == pda.stack_tail_letter:
+                self.stack_alpha_input.setText(letter)
+                self.add_alphabet('stack')
+        self.stack_tail_combo.setCurrentText(pda.stack_tail_letter)
+
+        for source, destination, _input, stack_read, stack_write in pda.transitions.rows():
+            self.add_transition_row()
+            row = self.transition_table.rowCount() - 1
+            for column, value in enumerate((source, destination, PDA.lamb(_input), PDA.lamb(stack_read))):
+                self.select_item(self.transition_table.cellWidget(row, column), value)
+            self.transition_table.cellWidget(row, 4).setText(stack_write)
+
+    def select_item(self, combo, text):
+        # Transitions may use states and symbols that are not declared; keep
+        # them as they are instead of falling back to the first item
+        if combo.findText(text) < 0:
+            combo.addItem(text)
+        combo.setCurrentText(text)
+
     def validate_and_accept(self):
+        self.build_all_tabs()
         # Validate states
         self.initial_state = self.initial_radio_group.checkedButton().text() if self.initial_radio_group.checkedButton() else None
         self.final_states = [cb.text() for cb in self.final_checkboxes if cb.isChecked()]
@@ -253,6 +446,10 @@ class PDADialog(QtWidgets.QDialog):
         self.accept()
 
     def generate_xml(self):
+        import tempfile
+        from xml.etree.ElementTree import Element, SubElement, tostring
+        from xml.dom import minidom
+
         root = Element('Automata', type="PDA")
         
         # Alphabets
@@ -292,6 +489,161 @@ class PDADialog(QtWidgets.QDialog):
         self.temp_file.write(xml_str.encode())
         self.temp_file.close()
 
+class TableRows:
+    # Row access for CFGModel over a ProductionTable, rendered on demand
+    def __init__(self, table):
+        self.table = table
+        self.formatter = ProductionFormatter(table.pda)
+
+    def __len__(self):
+        return len(self.table)
+
+    def text(self, row):
+        return self.formatter.text(*self.table[row])
+
+    def matching(self, text):
+        # Rows whose head name contains text; the test runs once per distinct
+        # head id, so only the names of the heads are ever built
+        nonterminal = self.formatter.nonterminal
+        matches = {}
+        rows = []
+        for row, head in enumerate(self.table.head):
+            match = matches.get(head)
+            if match is None:
+                match = matches[head] = text in nonterminal(head)
+            if match:
+                rows.append(row)
+        return rows
+
+
+class LineRows:
+    # Row access for CFGModel over already formatted lines
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def text(self, row):
+        return self.lines[row]
+
+    def matching(self, text):
+        return [row for row, line in enumerate(self.lines) if text in line[:line.find(' → ')]]
+
+
+class CFGModel(QtCore.QAbstractListModel):
+    # Exposes the productions in batches through canFetchMore/fetchMore and
+    # filters them by head nonterminal; rows only render text when shown
+    batch_size = 1000
+
+    def __init__(self, rows, parent=None):
+        super().__init__(parent)
+        self.rows = rows
+        self.visible = None
+        self.loaded = 0
+
+    def row_count(self):
+        return len(self.rows) if self.visible is None else len(self.visible)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self.loaded < self.row_count()
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        count = min(self.batch_size, self.row_count() - self.loaded)
+        self.beginInsertRows(QtCore.QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        row = index.row() if self.visible is None else self.visible[index.row()]
+        return self.rows.text(row)
+
+    def set_filter(self, text):
+        self.beginResetModel()
+        if text:
+            self.visible = self.rows.matching(text)
+        else:
+            self.visible = None
+        self.loaded = 0
+        self.endResetModel()
+
+    def visible_rows(self):
+        return range(len(self.rows)) if self.visible is None else self.visible
+
+
+class CFGViewer(QtWidgets.QDialog):
+    def __init__(self, rows, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Result CFG")
+        self.resize(700, 600)
+        self.model = CFGModel(rows, self)
+
+        self.filter_input = QtWidgets.QLineEdit()
+        self.filter_input.setPlaceholderText("Filter by head nonterminal, e.g. (q0z")
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(200)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter_input.textChanged.connect(self.filter_timer.start)
+
+        self.list_view = QtWidgets.QListView()
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setModel(self.model)
+        font = QtGui.QFont("Consolas")
+        font.setStyleHint(QtGui.QFont.Monospace)
+        self.list_view.setFont(font)
+
+        self.count_label = QtWidgets.QLabel()
+        save_btn = QtWidgets.QPushButton("Save...")
+        save_btn.clicked.connect(self.save)
+
+        controls = QtWidgets.QHBoxLayout()
+        controls.addWidget(self.count_label)
+        controls.addStretch()
+        controls.addWidget(save_btn)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.filter_input)
+        layout.addWidget(self.list_view)
+        layout.addLayout(controls)
+        self.setLayout(layout)
+        self.update_count()
+
+    def apply_filter(self):
+        self.model.set_filter(self.filter_input.text().strip())
+        self.update_count()
+
+    def update_count(self):
+        self.count_label.setText(f"{self.model.row_count()} of {len(self.model.rows)} productions")
+
+    def save(self):
+        rows = self.model.rows
+        filters = ['Text Files (*.txt *.cfg)']
+        if isinstance(rows, TableRows):
+            filters.extend(EXPORT_FILTERS)
+        file_name, selected = QtWidgets.QFileDialog.getSaveFileName(self, 'Save CFG', '', ';;'.join(filters))
+        if not file_name:
+            return
+
+        if selected in EXPORT_FILTERS:
+            # Exports always cover the whole grammar, whatever the filter shows
+            from export import export_grammar
+
+            try:
+                export_grammar(rows.table.pda, file_name, EXPORT_FILTERS[selected], table=rows.table)
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(self, "Export failed", str(e))
+            return
+
+        with open(file_name, 'w', encoding='utf-8') as output:
+            write_lines(output, (rows.text(row) for row in self.model.visible_rows()))
+
+
 class MainWindow(object):
     def setupUi(self, main_window):
         main_window.setObjectName("main_window")
@@ -472,23 +824,23 @@ class MainWindow(object):
         welcome_layout.addStretch()
         self.welcome_widget.setLayout(welcome_layout)
 
-        # SVG Display Area
-        self.visualization_widget = QtWidgets.QWidget()
-        vis_layout = QtWidgets.QVBoxLayout(self.visualization_widget)  # Create layout and assign to widget
-        self.center_image = QtSvg.QSvgWidget()
-        self.center_image.setStyleSheet("""
-            background-color: #353535;
-            border: 2px solid #444;
-            border-radius: 5px;
-            padding: 10px;
-        """)
-        vis_layout.addWidget(self.center_image)
-        
         self.stacked_widget.addWidget(self.welcome_widget)
-        self.stacked_widget.addWidget(self.visualization_widget)
         self.stacked_widget.setCurrentIndex(0)
+        self.visualization_widget = None
         main_window.setCentralWidget(self.central_widget)
 
+        # Statistics panel: phase timings and counters of the loaded PDA
+        self.stats_dock = QtWidgets.QDockWidget(main_window)
+        self.stats_dock.setObjectName("stats_dock")
+        self.stats_text = QtWidgets.QPlainTextEdit()
+        self.stats_text.setReadOnly(True)
+        self.stats_text.setStyleSheet("font-family: monospace; background: #353535; border: 1px solid #444;")
+        self.stats_dock.setWidget(self.stats_text)
+        main_window.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.stats_dock)
+        self.stats_dock.hide()
+        self.stats_dock.visibilityChanged.connect(lambda visible: visible and self.update_stats())
+        self.metrics = None
+
         # Menu System Setup
         self.menu_bar = QtWidgets.QMenuBar(main_window)
         self.menu_bar.setGeometry(QtCore.QRect(0, 0, 1200, 24))
@@ -514,6 +866,9 @@ class MainWindow(object):
         self.action_png = QtWidgets.QAction(main_window)
         self.action_svg = QtWidgets.QAction(main_window)
         self.action_convert = QtWidgets.QAction(main_window)
+        self.action_edit_pda = QtWidgets.QAction(main_window)
+        self.action_load_groups = QtWidgets.QAction(main_window)
+        self.action_default_groups = QtWidgets.QAction(main_window)
 
         # Font settings
         font = QtGui.QFont()
@@ -535,7 +890,14 @@ class MainWindow(object):
         self.menu_file.addAction(self.action_exit)
         
         self.menu_help.addAction(self.action_about)
+        self.menu_pda.addAction(self.action_edit_pda)
         self.menu_pda.addAction(self.action_convert)
+        self.menu_pda.addSeparator()
+        self.menu_pda.addAction(self.action_load_groups)
+        self.menu_pda.addAction(self.action_default_groups)
+        self.menu_pda.addSeparator()
+        self.action_stats = self.stats_dock.toggleViewAction()
+        self.menu_pda.addAction(self.action_stats)
 
         # Add menus to menu bar
         self.menu_bar.addAction(self.menu_file.menuAction())
@@ -553,6 +915,15 @@ class MainWindow(object):
         self.action_open_pda.triggered.connect(self.open_pda)
         self.action_exit.triggered.connect(self.app_exit)
         self.action_convert.triggered.connect(self.convert_to_cfg)
+        self.action_edit_pda.triggered.connect(self.edit_pda)
+        self.action_load_groups.triggered.connect(self.load_groups)
+        self.action_default_groups.triggered.connect(self.reset_groups)
+        self.incremental = None
+        self.incremental_worker = None
+        self.user_groups = None
+        self.thread_pool = QtCore.QThreadPool.globalInstance()
+        self.workers = set()
+        self.render_worker = None
         self.action_gv.triggered.connect(lambda: self.export_as('gv'))
         self.action_pdf.triggered.connect(lambda: self.export_as('pdf'))
         self.action_png.triggered.connect(lambda: self.export_as('png'))
@@ -561,6 +932,51 @@ class MainWindow(object):
 
         self.show_welcome_screen()
         
+    def setup_visualization(self):
+        # SVG display area, built when the first diagram is rendered
+        if self.visualization_widget is not None:
+            return
+
+        self.visualization_widget = QtWidgets.QWidget()
+        vis_layout = QtWidgets.QVBoxLayout(self.visualization_widget)  # Create layout and assign to widget
+
+        # Diagram controls: detail level for clustered diagrams and zoom
+        controls_layout = QtWidgets.QHBoxLayout()
+        self.detail_label = QtWidgets.QLabel("Detail:")
+        self.detail_combo = QtWidgets.QComboBox()
+        self.detail_combo.setMinimumWidth(250)
+        self.detail_combo.currentIndexChanged.connect(self.change_detail)
+        controls_layout.addWidget(self.detail_label)
+        controls_layout.addWidget(self.detail_combo)
+        controls_layout.addStretch()
+        self.zoom_out_button = QtWidgets.QPushButton("−")
+        self.zoom_in_button = QtWidgets.QPushButton("+")
+        self.zoom_fit_button = QtWidgets.QPushButton("Fit")
+        for button in (self.zoom_out_button, self.zoom_in_button, self.zoom_fit_button):
+            button.setFixedWidth(50)
+            controls_layout.addWidget(button)
+        self.zoom_out_button.clicked.connect(lambda: self.set_zoom(self.current_zoom() / 1.25))
+        self.zoom_in_button.clicked.connect(lambda: self.set_zoom(self.current_zoom() * 1.25))
+        self.zoom_fit_button.clicked.connect(lambda: self.set_zoom(None))
+        vis_layout.addLayout(controls_layout)
+
+        from PyQt5 import QtSvg
+
+        self.center_image = QtSvg.QSvgWidget()
+        self.center_image.setStyleSheet("""
+            background-color: #353535;
+            border: 2px solid #444;
+            border-radius: 5px;
+            padding: 10px;
+        """)
+        self.image_scroll = QtWidgets.QScrollArea()
+        self.image_scroll.setAlignment(QtCore.Qt.AlignCenter)
+        self.image_scroll.setWidget(self.center_image)
+        self.image_scroll.setWidgetResizable(True)
+        self.zoom = None
+        vis_layout.addWidget(self.image_scroll)
+        self.stacked_widget.addWidget(self.visualization_widget)
+
     def retranslateUi(self, main_window):
         _translate = QtCore.QCoreApplication.translate
         main_window.setWindowTitle(_translate("main_window", "PDA to CFG"))
@@ -582,6 +998,12 @@ class MainWindow(object):
         self.action_png.setText(_translate("main_window", ".png"))
         self.action_svg.setText(_translate("main_window", ".svg"))
         self.action_convert.setText(_translate("main_window", "Convert to CFG"))
+        self.action_edit_pda.setText(_translate("main_window", "Edit PDA"))
+        self.action_edit_pda.setShortcut(_translate("main_window", "Ctrl+E"))
+        self.action_load_groups.setText(_translate("main_window", "Load Diagram Groups..."))
+        self.action_default_groups.setText(_translate("main_window", "Default Diagram Groups"))
+        self.stats_dock.setWindowTitle(_translate("main_window", "Statistics"))
+        self.action_stats.setShortcut(_translate("main_window", "Ctrl+T"))
 
     def set_menu_state(self, state):
         self.action_gv.setEnabled(state)
@@ -589,6 +1011,9 @@ class MainWindow(object):
         self.action_png.setEnabled(state)
         self.action_svg.setEnabled(state)
         self.action_convert.setEnabled(state)
+        self.action_edit_pda.setEnabled(state)
+        self.action_load_groups.setEnabled(state)
+        self.action_default_groups.setEnabled(state)
 
     def new_pda(self):
         dialog = PDADialog(self.central_widget)
@@ -599,6 +1024,98 @@ class MainWindow(object):
                 import os
                 os.unlink(dialog.temp_file.name)  # Cleanup temp file
 
+    def edit_pda(self):
+        if self.incremental_worker is not None and not self.incremental_worker.cancelled:
+            QtWidgets.QMessageBox.information(
+                self.central_widget, "Busy", "The previous edit is still being prepared.")
+            return
+
+        dialog = PDADialog(self.central_widget)
+        dialog.load_pda(self.pda)
+        if dialog.exec_() != QtWidgets.QDialog.Accepted:
+            return
+
+        import os
+        os.unlink(dialog.temp_file.name)  # Edits are applied to the loaded PDA
+        if self.incremental is not None and self.incremental.pda is self.pda:
+            self.finish_pda_edits(dialog, self.incremental)
+            return
+
+        # The first edit needs the blocks of the whole grammar, which take
+        # seconds on large machines, so they are rendered on the thread pool
+        def built(incremental):
+            self.incremental_worker = None
+            if incremental.pda is self.pda:
+                self.finish_pda_edits(dialog, incremental)
+
+        def failed():
+            self.incremental_worker = None
+
+        self.incremental_worker = self.start_worker(
+            incremental_job(self.pda), "Preparing incremental conversion...", built, failed)
+
+    def finish_pda_edits(self, dialog, incremental):
+        # incremental matches the loaded PDA whether or not the edits apply
+        self.incremental = incremental
+        try:
+            self.apply_pda_edits(dialog, incremental)
+            self.render_pda()
+        except Exception as e:
+            QtWidgets.QMessageBox.critical(self.central_widget, "Error", str(e))
+
+    def apply_pda_edits(self, dialog, incremental):
+        # Diff the dialog against the loaded PDA and hand only the changed
+        # states and transitions to the incremental converter. Each applied
+        # edit logs its inverse, so a rejected one rolls all of them back.
+        pda = self.pda
+        trs = pda.transitions
+        saved = (pda.initial_state, set(pda.final_states), set(pda.input_alphabets), set(pda.stack_alphabets),
+                 pda.stack_tail_letter)
+        undo = []
+        try:
+            for state in dialog.states:
+                if state not in pda.states:
+                    incremental.add_state(state)
+                    undo.append((incremental.remove_state, state))
+            for state in sorted(pda.states - set(dialog.states)):
+                incremental.remove_state(state)
+                undo.append((incremental.add_state, state))
+            pda.initial_state = dialog.initial_state
+            pda.final_states = set(dialog.final_states)
+            pda.input_alphabets = set(dialog.input_alphabets)
+            pda.stack_alphabets = set(dialog.stack_alphabets)
+            pda.stack_tail_letter = dialog.stack_tail
+            pda.state_table.intern(pda.initial_state)
+            pda.stack_table.intern(pda.stack_tail_letter)
+
+            old_rows = [tuple(PDA.lamb(field, True) for field in row) for row in trs.rows()]
+            new_rows = [tuple(PDA.lamb(tr[key], True) for key in ('source', 'destination', 'input', 'stack_read', 'stack_write'))
+                        for tr in dialog.transitions]
+            matcher = difflib.SequenceMatcher(None, old_rows, new_rows, autojunk=False)
+            for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+                if tag == 'equal':
+                    continue
+                common = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+                for offset in range(common):
+                    old = trs.row(i1 + offset)
+                    incremental.replace_transition(i1 + offset, *new_rows[j1 + offset])
+                    undo.append((incremental.replace_transition, i1 + offset) + old)
+                for index in range(i2 - 1, i1 + common - 1, -1):
+                    old = trs.row(index)
+                    incremental.remove_transition(index)
+                    undo.append((incremental.insert_transition, index) + old)
+                for offset in range(common, j2 - j1):
+                    incremental.insert_transition(i1 + offset, *new_rows[j1 + offset])
+                    undo.append((incremental.remove_transition, i1 + offset))
+        except Exception:
+            for action, *args in reversed(undo):
+                action(*args)
+            pda.initial_state, pda.final_states, pda.input_alphabets, pda.stack_alphabets, pda.stack_tail_letter = saved
+            raise
+
+        # The edited PDA no longer matches its file's cache entries
+        pda.cache_key = None
+
     def open_pda(self):
         file_name, _ = QtWidgets.QFileDialog.getOpenFileName(
             self.central_widget, 'Open PDA file...', '.', 'XML Files (*.xml)')
@@ -607,48 +1124,169 @@ class MainWindow(object):
 
     def open_pda_from_file(self, file_name):
         try:
-            self.pda = PDA(file_name)
+            if not hasattr(self, 'cache'):
+                from cache import PDACache
+
+                self.cache = PDACache()
+            self.metrics = Metrics()
+            self.pda = self.cache.load(file_name, self.metrics)
+            self.incremental = None
+            self.user_groups = None
             self.render_pda()
             self.set_menu_state(True)
         except Exception as e:
             QtWidgets.QMessageBox.critical(self.central_widget, "Error", str(e))
 
-    def render_pda(self):
-        try:
-            f = Digraph('pda_machine', filename='pda_tmp.gv', format='svg')
-            f.attr(rankdir='LR', size='8,5')
-            
-            # Initial state
-            f.attr('node', shape='plaintext')
-            f.node(' ')
-            f.attr('node', shape='circle')
-            f.node(self.pda.initial_state)
-            f.edge(' ', self.pda.initial_state, ' ')
-            
-            # Final states
-            f.attr('node', shape='doublecircle')
-            for fs in self.pda.final_states:
-                f.node(fs)
-            
-            # Transitions
-            f.attr('node', shape='circle')
-            for tr in self.pda.transitions:
-                label = f"{PDA.lamb(tr['input'])},{PDA.lamb(tr['stack_read'])},{PDA.lamb(tr['stack_write'])}"
-                f.edge(tr['source'], tr['destination'], label)
-            
-            f.render()
-            self.center_image.load('pda_tmp.gv.svg')
-            self.graph = f
+    def start_worker(self, job, title, on_finished, on_failed=None):
+        # Run job on the thread pool behind a cancellable progress dialog
+        worker = Worker(job)
+        progress = QtWidgets.QProgressDialog(title, "Cancel", 0, max(1, len(self.pda.transitions)), self.central_widget)
+        progress.setWindowTitle(title)
+        progress.setMinimumDuration(500)
 
-            # Switch to visualization view
-            self.stacked_widget.setCurrentIndex(1)
-            self.set_menu_state(True)
-            
+        def report(transitions, productions):
+            progress.setValue(min(transitions, progress.maximum()))
+            if productions:
+                progress.setLabelText(f"{title}\n{transitions} transitions, {productions} productions")
+
+        def done():
+            progress.close()
+            self.workers.discard(worker)
+
+        def finished(result):
+            done()
+            on_finished(result)
+            self.update_stats()
+
+        def failed(message):
+            done()
+            QtWidgets.QMessageBox.critical(self.central_widget, "Error", message)
+            if on_failed:
+                on_failed()
+
+        def cancel():
+            worker.cancel()
+            done()
+
+        worker.signals.progress.connect(report)
+        worker.signals.finished.connect(finished)
+        worker.signals.failed.connect(failed)
+        progress.canceled.connect(cancel)
+        worker.stop = cancel
+        self.workers.add(worker)
+        self.thread_pool.start(worker)
+        return worker
+
+    def render_pda(self, focus=None):
+        import hashlib
+        from graphviz import Source
+
+        self.setup_visualization()
+        if self.render_worker is not None:
+            self.render_worker.stop()
+            self.render_worker = None
+
+        # Large machines are drawn with their clusters collapsed; picking a
+        # cluster in the detail box redraws it with those states expanded.
+        # Groups loaded by the user replace the default clusters.
+        if focus is None:
+            if self.user_groups is not None:
+                self.diagram_groups = {state: group for state, group in self.user_groups.items()
+                                       if state in self.pda.states}
+            else:
+                self.diagram_groups = self.pda.default_groups()
+            self.update_detail_combo()
+
+        # DOT is generated in-process and piped through Graphviz, so nothing
+        # touches the working directory and an unchanged diagram is free
+        with self.pda.phase('dot'):
+            self.graph = Source(self.pda.to_dot(self.diagram_groups, focus), format='svg')
+        key = hashlib.sha256(self.graph.source.encode()).hexdigest()
+        svg = SVG_CACHE.get(key)
+        if svg is not None:
+            SVG_CACHE.move_to_end(key)
+            self.show_rendered_pda(svg)
+            return
+
+        def rendered(svg):
+            SVG_CACHE[key] = svg
+            while len(SVG_CACHE) > SVG_CACHE_SIZE:
+                SVG_CACHE.popitem(last=False)
+            self.show_rendered_pda(svg)
+
+        self.render_worker = self.start_worker(
+            render_job(self.graph, self.pda), "Rendering diagram...", rendered, self.show_welcome_screen)
+
+    def load_groups(self):
+        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self.central_widget, 'Load diagram groups...', '.', 'JSON Files (*.json)')
+        if not file_name:
+            return
+
+        try:
+            self.user_groups = self.pda.read_groups(file_name)
         except Exception as e:
             QtWidgets.QMessageBox.critical(self.central_widget, "Error", str(e))
-            # Stay on welcome screen if error occurs
-            self.stacked_widget.setCurrentIndex(0)
-            self.show_welcome_screen()
+            return
+        self.render_pda()
+
+    def reset_groups(self):
+        self.user_groups = None
+        self.render_pda()
+
+    def update_detail_combo(self):
+        clusters = sorted(set(self.diagram_groups.values()))
+        self.detail_combo.blockSignals(True)
+        self.detail_combo.clear()
+        self.detail_combo.addItem("Overview")
+        self.detail_combo.addItems(clusters)
+        self.detail_combo.blockSignals(False)
+        self.detail_label.setVisible(bool(clusters))
+        self.detail_combo.setVisible(bool(clusters))
+
+    def change_detail(self, index):
+        if index <= 0:
+            self.render_pda()
+            return
+
+        group = self.detail_combo.itemText(index)
+        self.render_pda([state for state, name in self.diagram_groups.items() if name == group])
+
+    def current_zoom(self):
+        if self.zoom is not None:
+            return self.zoom
+
+        size = self.center_image.renderer().defaultSize()
+        return min(self.center_image.width() / max(1, size.width()), self.center_image.height() / max(1, size.height()))
+
+    def set_zoom(self, zoom):
+        # None fits the diagram to the window; otherwise scale its natural size
+        self.zoom = zoom
+        if zoom is None:
+            self.image_scroll.setWidgetResizable(True)
+            return
+
+        self.zoom = min(max(zoom, 0.05), 20.0)
+        self.image_scroll.setWidgetResizable(False)
+        self.center_image.resize(self.center_image.renderer().defaultSize() * self.zoom)
+
+    def update_stats(self):
+        if self.metrics is None or not self.stats_dock.isVisible():
+            return
+
+        self.stats_text.setPlainText('\n'.join(format_metrics(self.metrics)))
+
+    def show_rendered_pda(self, svg):
+        self.render_worker = None
+        self.center_image.load(QtCore.QByteArray(svg))
+        self.update_stats()
+        if self.zoom is not None:
+            self.set_zoom(self.zoom)
+
+        # Switch to visualization view
+        self.stacked_widget.setCurrentIndex(1)
+        self.set_menu_state(True)
+
     def export_as(self, file_type):
         file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
             self.central_widget, 
@@ -661,16 +1299,17 @@ class MainWindow(object):
             self.graph.render(file_name)
 
     def convert_to_cfg(self):
-        try:
-            self.cfg = self.pda.convert_to_cfg()
-            messageBox = QtWidgets.QMessageBox()
-            messageBox.setText('<font size=16>' + '<br>'.join(self.cfg) + '</font>')
-            messageBox.setWindowTitle('Result CFG')
-            messageBox.exec_()
-        except AttributeError:
+        if not hasattr(self, 'pda'):
             QtWidgets.QMessageBox.warning(self.central_widget, "Error", "No PDA loaded!")
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self.central_widget, "Error", str(e))
+            return
+
+        self.start_worker(convert_job(self.pda, self.cache, self.incremental), "Converting to CFG...", self.show_cfg)
+
+    def show_cfg(self, cfg):
+        self.cfg = cfg
+        rows = TableRows(cfg) if isinstance(cfg, ProductionTable) else LineRows(cfg)
+        self.cfg_viewer = CFGViewer(rows, self.central_widget)
+        self.cfg_viewer.show()
 
     def show_about_dialog(self):
         QtWidgets.QMessageBox.information(
@@ -0,0 +1,99 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Metrics:
+    # Phase timers and counters for loading and converting a PDA. Measured
+    # code checks for a Metrics object once per phase or per batch, never per
+    # production, so a PDA without one runs the plain code paths. callback,
+    # if given, is called as callback(kind, name, value) with kind 'phase'
+    # (value in seconds) or 'counter' as figures come in. profile wraps the
+    # outermost phases in cProfile, trace_memory in tracemalloc.
+    def __init__(self, callback=None, profile=False, trace_memory=False):
+        self.timers = {}
+        self.counters = {}
+        self.callback = callback
+        self.profiler = None
+        if profile:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+        self.trace_memory = trace_memory
+        self.memory_peak = None
+        self.depth = 0
+
+
+    @contextmanager
+    def phase(self, name):
+        outermost = self.depth == 0
+        started_tracing = False
+        if outermost:
+            if self.trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            if self.profiler is not None:
+                self.profiler.enable()
+
+        self.depth += 1
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - started
+            self.depth -= 1
+            if outermost:
+                if self.profiler is not None:
+                    self.profiler.disable()
+                if self.trace_memory and tracemalloc.is_tracing():
+                    peak = tracemalloc.get_traced_memory()[1]
+                    self.memory_peak = max(self.memory_peak or 0, peak)
+                    if started_tracing:
+                        tracemalloc.stop()
+
+            self.add_time(name, elapsed)
+
+
+    def add_time(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+        if self.callback is not None:
+            self.callback('phase', name, seconds)
+
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.callback is not None:
+            self.callback('counter', name, value)
+
+
+    def as_dict(self):
+        result = {'timers': dict(self.timers), 'counters': dict(self.counters)}
+        if self.memory_peak is not None:
+            result['memory_peak'] = self.memory_peak
+        if self.profiler is not None:
+            result['profile'] = self.profile_text()
+        return result
+
+
+    def profile_text(self, limit=20):
+        if self.profiler is None:
+            return ''
+
+        import io
+        import pstats
+
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+
+def format_metrics(metrics):
+    # Summary lines for a Metrics object or its as_dict() form
+    if isinstance(metrics, Metrics):
+        metrics = metrics.as_dict()
+
+    lines = ['{}: {:.3f}s'.format(name, seconds) for name, seconds in metrics['timers'].items()]
+    lines.extend('{}: {}'.format(name, value) for name, value in metrics['counters'].items())
+    if 'memory_peak' in metrics:
+        lines.append('traced memory peak: {:.1f} MB'.format(metrics['memory_peak'] / (1 << 20)))
+    return lines
@@ -1,26 +1,766 @@
+import copy
+import glob
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
 import xml.etree.ElementTree as ET
+from array import array
+from collections import deque
+from contextlib import nullcontext
+from itertools import islice
+from types import MappingProxyType
+from metrics import Metrics, format_metrics
+
+
+LAMBDAS = ('', 'lambda', 'λ')
+LAMBDA = -1
+NONE = -1
+
+# Bump whenever the generated grammar text changes, it keys cached results.
+CONVERTER_VERSION = 2
+
+COMPILED_MAGIC = b'PDAC'
+COMPILED_VERSION = 1
+COMPILED_HEADER = struct.Struct('<4sIQQQ')
+
+ACCEPTANCE_MODES = ('empty', 'final')
+DRAIN_STATE = 'qe'
+# Diagram sizes above which states are clustered and sfdp lays the graph out
+LARGE_DIAGRAM_STATES = 150
+LARGE_DIAGRAM_TRANSITIONS = 1500
+SFDP_THRESHOLD = 100
+# Most states drawn as one cluster; bigger components are split
+MAX_GROUP_STATES = 50
+MAX_EDGE_LABELS = 4
+# Smallest grammar worth converting on several processes; below this
+# starting the pool costs more than it saves
+PARALLEL_MIN_PRODUCTIONS = 1 << 20
+
+TRANSITION_COLUMNS = ('source', 'destination', 'input', 'stack_read', 'write_offsets', 'write_symbols')
+
+
+class SymbolTable:
+    __slots__ = ('names', 'ids')
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+
+    def intern(self, name):
+        if name in LAMBDAS:
+            return LAMBDA
+
+        symbol_id = self.ids.get(name)
+        if symbol_id is None:
+            symbol_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+
+        return symbol_id
+
+
+    def name(self, symbol_id):
+        return '' if symbol_id == LAMBDA else self.names[symbol_id]
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def __contains__(self, name):
+        return name in self.ids
+
+
+    def __iter__(self):
+        return iter(self.names)
+
+
+class TransitionTable:
+    # Transitions as parallel integer columns; stack writes are stored flat
+    # in write_symbols, transition i owning write_offsets[i]:write_offsets[i + 1].
+    # Columns are array('l'), or read-only memoryviews into `buffer` for a
+    # table opened with PDA.from_compiled until the first append.
+    __slots__ = ('states', 'inputs', 'stack', 'source', 'destination', 'input', 'stack_read',
+                 'write_offsets', 'write_symbols', 'buffer', '_by_source', '_by_destination', '_chains')
+
+    def __init__(self, states, inputs, stack):
+        self.states = states
+        self.inputs = inputs
+        self.stack = stack
+        self.source = array('l')
+        self.destination = array('l')
+        self.input = array('l')
+        self.stack_read = array('l')
+        self.write_offsets = array('l', [0])
+        self.write_symbols = array('l')
+        self.buffer = None
+        self._by_source = None
+        self._by_destination = None
+        self._chains = None
+
+
+    @property
+    def by_source(self):
+        # (source, input, stack_read) -> transition ids
+        if self._by_source is None:
+            self.build_indexes()
+        return self._by_source
+
+
+    @property
+    def by_destination(self):
+        # destination -> transition ids
+        if self._by_destination is None:
+            self.build_indexes()
+        return self._by_destination
+
+
+    @property
+    def chains(self):
+        # (destination, prefix) -> chain id for every prefix of two or more
+        # symbols, short of the whole write, of a stack write longer than
+        # two; ids follow first use in transition order
+        if self._chains is None:
+            chains = {}
+            for index in range(len(self.source)):
+                stack_write = tuple(self.stack_write(index))
+                for length in range(2, len(stack_write)):
+                    chains.setdefault((self.destination[index], stack_write[:length]), len(chains))
+            self._chains = chains
+        return self._chains
+
+
+    def build_indexes(self):
+        by_source = {}
+        by_destination = {}
+        for index, key in enumerate(zip(self.source, self.input, self.stack_read)):
+            by_source.setdefault(key, array('l')).append(index)
+            by_destination.setdefault(self.destination[index], array('l')).append(index)
+
+        self._by_source = by_source
+        self._by_destination = by_destination
+
+
+    def make_writable(self):
+        if self.buffer is not None:
+            for column in TRANSITION_COLUMNS:
+                setattr(self, column, array('l', getattr(self, column)))
+            self.buffer = None
+
+
+    def __getstate__(self):
+        state = {slot: getattr(self, slot) for slot in self.__slots__}
+        state['buffer'] = None
+        for column in TRANSITION_COLUMNS:
+            state[column] = array('l', state[column])
+        return state
+
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+
+    def append(self, source, destination, _input, stack_read, stack_write):
+        self.make_writable()
+        index = len(self.source)
+        source = self.states.intern(source)
+        destination = self.states.intern(destination)
+        _input = self.inputs.intern(_input)
+        stack_read = self.stack.intern(stack_read)
+
+        self.source.append(source)
+        self.destination.append(destination)
+        self.input.append(_input)
+        self.stack_read.append(stack_read)
+        if stack_write not in LAMBDAS:
+            self.write_symbols.extend(self.stack.intern(letter) for letter in stack_write)
+        self.write_offsets.append(len(self.write_symbols))
+
+        if self._by_source is not None:
+            self._by_source.setdefault((source, _input, stack_read), array('l')).append(index)
+            self._by_destination.setdefault(destination, array('l')).append(index)
+        self._chains = None
+        return index
+
+
+    def insert(self, index, source, destination, _input, stack_read, stack_write):
+        if index == len(self.source):
+            return self.append(source, destination, _input, stack_read, stack_write)
+
+        self.make_writable()
+        write = array('l')
+        if stack_write not in LAMBDAS:
+            write.extend(self.stack.intern(letter) for letter in stack_write)
+
+        self.source.insert(index, self.states.intern(source))
+        self.destination.insert(index, self.states.intern(destination))
+        self.input.insert(index, self.inputs.intern(_input))
+        self.stack_read.insert(index, self.stack.intern(stack_read))
+        offset = self.write_offsets[index]
+        self.write_symbols[offset:offset] = write
+        self.write_offsets[index + 1:] = array('l', [offset + len(write)] + [
+            end + len(write) for end in self.write_offsets[index + 1:]])
+
+        self._by_source = self._by_destination = self._chains = None
+        return index
+
+
+    def remove(self, index):
+        self.make_writable()
+        for column in (self.source, self.destination, self.input, self.stack_read):
+            del column[index]
+
+        start = self.write_offsets[index]
+        length = self.write_offsets[index + 1] - start
+        del self.write_symbols[start:start + length]
+        self.write_offsets[index + 1:] = array('l', [end - length for end in self.write_offsets[index + 2:]])
+
+        self._by_source = self._by_destination = self._chains = None
+
+
+    def replace(self, index, source, destination, _input, stack_read, stack_write):
+        self.remove(index)
+        return self.insert(index, source, destination, _input, stack_read, stack_write)
+
+
+    def stack_write(self, index):
+        return self.write_symbols[self.write_offsets[index]:self.write_offsets[index + 1]]
+
+
+    def row(self, index):
+        return (
+            self.states.name(self.source[index]),
+            self.states.name(self.destination[index]),
+            self.inputs.name(self.input[index]),
+            self.stack.name(self.stack_read[index]),
+            ''.join(self.stack.names[symbol] for symbol in self.stack_write(index))
+        )
+
+
+    def rows(self):
+        for index in range(len(self.source)):
+            yield self.row(index)
+
+
+    def __len__(self):
+        return len(self.source)
+
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.source)
+        if not 0 <= index < len(self.source):
+            raise IndexError('transition index out of range')
+
+        source, destination, _input, stack_read, stack_write = self.row(index)
+        return MappingProxyType({
+            'source': source,
+            'destination': destination,
+            'input': _input,
+            'stack_read': stack_read,
+            'stack_write': stack_write
+        })
+
+
+    def __iter__(self):
+        for index in range(len(self.source)):
+            yield self[index]
+
+
+class ProductionFormatter:
+    # Renders integer production records as display text, caching
+    # nonterminal names; the cache is dropped whenever it grows past
+    # cache_size so streaming stays bounded. Triples render as (pAq), chain
+    # nonterminals as [rB1..Bks] and the start symbol of final mode as S.
+    __slots__ = ('pda', 'names', 'cache_size', 'chain_keys')
+
+    def __init__(self, pda, cache_size=1 << 16):
+        self.pda = pda
+        self.names = {}
+        self.cache_size = cache_size
+        self.chain_keys = None
+
+
+    def nonterminal(self, triple):
+        name = self.names.get(triple)
+        if name is None:
+            if len(self.names) >= self.cache_size:
+                self.names.clear()
+
+            states = self.pda.state_table.names
+            stack = self.pda.stack_table.names
+            n_triples = self.pda.n_triples()
+            if triple < n_triples:
+                p, stack_symbol, q = self.pda.split_triple(triple)
+                name = '({}{}{})'.format(states[p], stack[stack_symbol], states[q])
+            else:
+                if self.chain_keys is None:
+                    self.chain_keys = list(self.pda.transitions.chains)
+                chain, s = divmod(triple - n_triples, len(states))
+                if chain == len(self.chain_keys):
+                    name = 'S'
+                else:
+                    r, prefix = self.chain_keys[chain]
+                    name = '[{}{}{}]'.format(states[r], ''.join(stack[symbol] for symbol in prefix), states[s])
+            self.names[triple] = name
+
+        return name
+
+
+    def text(self, head, terminal, left, right):
+        if left == NONE:
+            return self.nonterminal(head) + ' → ' + PDA.lamb(self.pda.input_table.name(terminal))
+
+        if right == NONE:
+            return self.nonterminal(head) + ' → ' + self.pda.input_table.name(terminal) + self.nonterminal(left)
+
+        return self.nonterminal(head) + ' → ' + self.pda.input_table.name(terminal) + self.nonterminal(left) + self.nonterminal(right)
+
+
+class NonterminalTable:
+    # Interns the triple and chain ids of a grammar as they are first named,
+    # giving each a dense id and the short name prefix + dense id; the start
+    # symbol is named start_name. Names never need splitting, so state and
+    # stack names of any length stay unambiguous, and legend() maps the
+    # names back to what they stand for.
+    __slots__ = ('pda', 'names', 'prefix')
+
+    def __init__(self, pda, prefix='N', start_name='S'):
+        self.pda = pda
+        self.prefix = prefix
+        # Seeded with the start symbol, so dense ids are len(names) - 1
+        self.names = {pda.start_symbol(): start_name}
+
+
+    def name(self, symbol):
+        name = self.names.get(symbol)
+        if name is None:
+            name = self.names[symbol] = self.prefix + str(len(self.names) - 1)
+        return name
+
+
+    def __len__(self):
+        return len(self.names) - 1
+
+
+    def legend(self):
+        # Tab-separated name, state, stack symbols and state per dense id: a
+        # triple (p A q) has one stack symbol, a chain [r B1..Bk s] several,
+        # separated by spaces
+        pda = self.pda
+        states = pda.state_table.names
+        stack = pda.stack_table.names
+        n_triples = pda.n_triples()
+        chains = list(pda.transitions.chains)
+        yield 'name\tfrom\tstack\tto'
+        for symbol, name in islice(self.names.items(), 1, None):
+            if symbol < n_triples:
+                p, stack_symbol, q = pda.split_triple(symbol)
+                symbols = stack[stack_symbol]
+            else:
+                chain, q = divmod(symbol - n_triples, len(states))
+                p, prefix = chains[chain]
+                symbols = ' '.join(stack[stack_symbol] for stack_symbol in prefix)
+            yield '{}\t{}\t{}\t{}'.format(name, states[p], symbols, states[q])
+
+
+    def write_legend(self, sink, chunk_size=1 << 16):
+        return write_lines(sink, self.legend(), chunk_size) - 1
+
+
+class CompactFormatter:
+    # ProductionFormatter counterpart over NonterminalTable names, with body
+    # symbols separated by spaces
+    __slots__ = ('pda', 'nonterminals')
+
+    def __init__(self, pda, nonterminals=None):
+        self.pda = pda
+        self.nonterminals = NonterminalTable(pda) if nonterminals is None else nonterminals
+
+
+    def nonterminal(self, symbol):
+        return self.nonterminals.name(symbol)
+
+
+    def text(self, head, terminal, left, right):
+        name = self.nonterminals.name
+        line = name(head) + ' → '
+        if left == NONE:
+            return line + ('λ' if terminal == LAMBDA else self.pda.input_table.names[terminal])
+
+        if terminal != LAMBDA:
+            line += self.pda.input_table.names[terminal] + ' '
+        if right == NONE:
+            return line + name(left)
+
+        return line + name(left) + ' ' + name(right)
+
+
+class ProductionTable:
+    # Production records in preallocated parallel columns, see
+    # PDA.iter_productions for the meaning of each column.
+    __slots__ = ('pda', 'head', 'terminal', 'left', 'right')
+
+    def __init__(self, pda, capacity):
+        zeros = array('l', [0]) * capacity
+        self.pda = pda
+        self.head = array('l', zeros)
+        self.terminal = array('l', zeros)
+        self.left = array('l', zeros)
+        self.right = array('l', zeros)
+
+
+    def append(self, head, terminal, left, right):
+        self.head.append(head)
+        self.terminal.append(terminal)
+        self.left.append(left)
+        self.right.append(right)
+
+
+    def __len__(self):
+        return len(self.head)
+
+
+    def __getitem__(self, index):
+        return self.head[index], self.terminal[index], self.left[index], self.right[index]
+
+
+    def __iter__(self):
+        return zip(self.head, self.terminal, self.left, self.right)
+
+
+    def render(self, start=0, stop=None, formatter=None):
+        formatter = formatter or ProductionFormatter(self.pda)
+        stop = len(self.head) if stop is None else min(stop, len(self.head))
+        text = formatter.text
+        return [text(*production) for production in zip(
+            self.head[start:stop], self.terminal[start:stop], self.left[start:stop], self.right[start:stop])]
+
+
+    def iter_text(self, batch_size=4096, formatter=None):
+        formatter = formatter or ProductionFormatter(self.pda)
+        for start in range(0, len(self.head), batch_size):
+            yield from self.render(start, start + batch_size, formatter)
+
+
+    def write(self, sink, chunk_size=1 << 16, formatter=None):
+        return write_lines(sink, self.iter_text(formatter=formatter), chunk_size)
+
+
+class IncrementalCFG:
+    # Unpruned grammar text of an editable PDA, kept as one block per
+    # transition: a pop block is its single line, a one-symbol push block
+    # maps s to its line and a longer push block maps (s, bs) to its line.
+    # The chain nonterminals of writes longer than two follow in blocks of
+    # their own, keyed like TransitionTable.chains. Editing a transition
+    # re-renders only its block, adding or removing a state only touches the
+    # lines mentioning that state. progress, if given, is called with the
+    # number of blocks rendered so far every chunk_size transitions.
+    def __init__(self, pda, progress=None, chunk_size=256):
+        self.pda = pda
+        self.names = {}
+        self.states = pda.declared_states()
+        self.blocks = []
+        for index in range(len(pda.transitions)):
+            self.blocks.append(self.render_block(index))
+            if progress is not None and (index + 1) % chunk_size == 0:
+                progress(index + 1)
+        self.chain_blocks = {}
+
+
+    def nonterminal(self, p, stack_symbol, q):
+        key = (p, stack_symbol, q)
+        name = self.names.get(key)
+        if name is None:
+            states = self.pda.state_table.names
+            name = self.names[key] = '({}{}{})'.format(states[p], self.pda.stack_table.names[stack_symbol], states[q])
+
+        return name
+
+
+    def chain_nonterminal(self, chain, s):
+        key = (chain, s)
+        name = self.names.get(key)
+        if name is None:
+            r, prefix = chain
+            states = self.pda.state_table.names
+            stack = self.pda.stack_table.names
+            name = self.names[key] = '[{}{}{}]'.format(states[r], ''.join(stack[symbol] for symbol in prefix), states[s])
+
+        return name
+
+
+    def pair_body(self, r, stack_write, s, bs):
+        # Body of a two-or-more symbol push from r ending in s via bs
+        if len(stack_write) == 2:
+            left = self.nonterminal(r, stack_write[0], bs)
+        else:
+            left = self.chain_nonterminal((r, tuple(stack_write[:-1])), bs)
+        return left + self.nonterminal(bs, stack_write[-1], s)
+
+
+    def push_line(self, index, s, bs=None):
+        trs = self.pda.transitions
+        stack_write = trs.stack_write(index)
+        head = self.nonterminal(trs.source[index], trs.stack_read[index], s) + ' → ' + \
+            self.pda.input_table.name(trs.input[index])
+        if bs is None:
+            return head + self.nonterminal(trs.destination[index], stack_write[0], s)
+
+        return head + self.pair_body(trs.destination[index], stack_write, s, bs)
+
+
+    def chain_line(self, chain, s, bs):
+        r, prefix = chain
+        return self.chain_nonterminal(chain, s) + ' → ' + self.pair_body(r, prefix, s, bs)
+
+
+    def render_block(self, index):
+        self.pda.check_transition(index)
+        trs = self.pda.transitions
+        write_length = trs.write_offsets[index + 1] - trs.write_offsets[index]
+        if write_length == 0:
+            return self.nonterminal(trs.source[index], trs.stack_read[index], trs.destination[index]) + \
+                ' → ' + PDA.lamb(self.pda.input_table.name(trs.input[index]))
+
+        if write_length == 1:
+            return {s: self.push_line(index, s) for s in self.states}
+
+        return {(s, bs): self.push_line(index, s, bs) for s in self.states for bs in self.states}
+
+
+    def insert_transition(self, index, source, destination, _input, stack_read, stack_write):
+        trs = self.pda.transitions
+        trs.insert(index, source, destination, _input, stack_read, stack_write)
+        try:
+            block = self.render_block(index)
+        except Exception:
+            # Keep the table and the blocks in step when the transition is rejected
+            trs.remove(index)
+            raise
+        self.blocks.insert(index, block)
+
+
+    def remove_transition(self, index):
+        self.pda.transitions.remove(index)
+        del self.blocks[index]
+
+
+    def replace_transition(self, index, source, destination, _input, stack_read, stack_write):
+        trs = self.pda.transitions
+        old = trs.row(index)
+        trs.replace(index, source, destination, _input, stack_read, stack_write)
+        try:
+            block = self.render_block(index)
+        except Exception:
+            trs.replace(index, *old)
+            raise
+        self.blocks[index] = block
+
+
+    def add_state(self, state):
+        if state in self.pda.states:
+            return
+
+        added = self.pda.add_state(state)
+        self.states = self.pda.declared_states()
+        for index, block in enumerate(self.blocks):
+            if isinstance(block, str):
+                continue
+
+            if self.pda.transitions.write_offsets[index + 1] - self.pda.transitions.write_offsets[index] == 1:
+                block[added] = self.push_line(index, added)
+                continue
+
+            for other in self.states:
+                block[added, other] = self.push_line(index, added, other)
+                block[other, added] = self.push_line(index, other, added)
+
+        for chain, block in self.chain_blocks.items():
+            for other in self.states:
+                block[added, other] = self.chain_line(chain, added, other)
+                block[other, added] = self.chain_line(chain, other, added)
+
+
+    def remove_state(self, state):
+        if state not in self.pda.states:
+            return
+
+        removed = self.pda.state_table.ids[state]
+        self.pda.remove_state(state)
+        for block in self.blocks + list(self.chain_blocks.values()):
+            if isinstance(block, dict):
+                block.pop(removed, None)
+                for other in self.states:
+                    block.pop((removed, other), None)
+                    block.pop((other, removed), None)
+        self.states = self.pda.declared_states()
+
+
+    def lines(self, progress=None, chunk_size=256):
+        # progress, if given, is called with the transitions and lines done so
+        # far every chunk_size transitions
+        trs = self.pda.transitions
+        count = 0
+        for index, block in enumerate(self.blocks):
+            if progress is not None and index % chunk_size == 0:
+                progress(index, count)
+            if isinstance(block, str):
+                count += 1
+                yield block
+            elif trs.write_offsets[index + 1] - trs.write_offsets[index] == 1:
+                count += len(self.states)
+                for s in self.states:
+                    yield block[s]
+            else:
+                count += len(self.states) ** 2
+                for s in self.states:
+                    for bs in self.states:
+                        yield block[s, bs]
+
+        # Chain blocks are rendered when a chain first shows up and dropped
+        # once no transition uses it any more
+        chains = trs.chains
+        self.chain_blocks = {chain: self.chain_blocks.get(chain) for chain in chains}
+        for chain in chains:
+            block = self.chain_blocks[chain]
+            if block is None:
+                block = self.chain_blocks[chain] = {
+                    (s, bs): self.chain_line(chain, s, bs) for s in self.states for bs in self.states}
+            for s in self.states:
+                for bs in self.states:
+                    yield block[s, bs]
+
+
+class StackNodes:
+    # Hash-consed persistent linked stack: node 0 is the empty stack and
+    # every other node is (symbol on top, node below). Equal stacks share one
+    # node id, so configurations compare and hash as plain ints.
+    __slots__ = ('symbol', 'below', 'ids')
+
+    def __init__(self):
+        self.symbol = array('l', [LAMBDA])
+        self.below = array('l', [0])
+        self.ids = {}
+
+
+    def push(self, node, symbol):
+        key = (node, symbol)
+        pushed = self.ids.get(key)
+        if pushed is None:
+            pushed = self.ids[key] = len(self.symbol)
+            self.symbol.append(symbol)
+            self.below.append(node)
+
+        return pushed
+
+
+    def push_all(self, node, symbols):
+        # symbols[0] ends up on top, as in a stackWrite string
+        for symbol in reversed(symbols):
+            node = self.push(node, symbol)
+
+        return node
 
 
 class PDA:
-    def __init__(self, file_name):
+    # Optional Metrics collecting phase timers and counters; see phase()
+    metrics = None
+    # How the grammar accepts: 'empty' derives the words accepted by empty
+    # stack from the (initial, tail, q) triples, 'final' is a copy made by
+    # to_empty_stack() with a drain state and an explicit start symbol S
+    acceptance = 'empty'
+    drain_state = None
+
+    def __init__(self, file_name, metrics=None):
         self.file_name = file_name
-        self.load_file()
+        self.metrics = metrics
+        with self.phase('parse'):
+            self.load_file()
+        self.count_transitions()
+
+
+    def __getstate__(self):
+        # Metrics hold a profiler and callbacks that stay in this process
+        state = self.__dict__.copy()
+        state.pop('metrics', None)
+        return state
+
+
+    def phase(self, name):
+        return nullcontext() if self.metrics is None else self.metrics.phase(name)
+
+
+    def count_transitions(self):
+        metrics = self.metrics
+        if metrics is None:
+            return
+
+        trs = self.transitions
+        offsets = trs.write_offsets
+        lengths = [offsets[i + 1] - offsets[i] for i in range(len(trs))]
+        metrics.count('transitions', len(trs))
+        metrics.count('push transitions', sum(1 for length in lengths if length > 1))
+        metrics.count('pop transitions', lengths.count(0))
+        metrics.count('replace transitions', lengths.count(1))
+        metrics.count('lambda input transitions', sum(1 for symbol in trs.input if symbol == LAMBDA))
 
 
     def load_file(self):
-        tree = ET.parse(self.file_name)
-        self.root = tree.getroot()
-        self.parse()
+        # Streams the file: the small Alphabets and States sections are parsed
+        # as whole elements, <transition> elements go straight into the
+        # transition table and are dropped as soon as they are consumed.
+        self.state_table = SymbolTable()
+        self.input_table = SymbolTable()
+        self.stack_table = SymbolTable()
+        self.transitions = TransitionTable(self.state_table, self.input_table, self.stack_table)
+        sections = set()
+        transitions_element = None
+        metrics = self.metrics
+        copying = 0.0
 
+        for event, element in ET.iterparse(self.file_name, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == 'Transitions':
+                    transitions_element = element
+                continue
 
-    def parse(self):
-        self.parse_alphabets()
-        self.parse_states()
-        self.parse_transitions()
+            if element.tag == 'transition':
+                if metrics is None:
+                    self.parse_transition(element)
+                else:
+                    started = time.perf_counter()
+                    self.parse_transition(element)
+                    copying += time.perf_counter() - started
+                if transitions_element is not None:
+                    transitions_element.clear()
 
-    
-    def parse_alphabets(self):
-        alphabets_element = self.root.find('Alphabets')
+            elif element.tag in ('Alphabets', 'States', 'Transitions'):
+                if element.tag == 'Alphabets':
+                    self.parse_alphabets(element)
+                elif element.tag == 'States':
+                    self.parse_states(element)
+                sections.add(element.tag)
+                element.clear()
+
+        for section in ('Alphabets', 'States', 'Transitions'):
+            if section not in sections:
+                raise Exception('No {} section!'.format(section))
+
+        if metrics is not None:
+            metrics.add_time('copy transitions', copying)
+
+
+    def parse_alphabets(self, alphabets_element):
         input_alphabets_element = alphabets_element.find('Input_alphabets')
         stack_alphabets_element = alphabets_element.find('Stack_alphabets')
 
@@ -30,10 +770,12 @@ class PDA:
 
         for alphabet in input_alphabets_element:
             input_alphabets.add(alphabet.attrib['letter'])
+            self.input_table.intern(alphabet.attrib['letter'])
 
         for alphabet in stack_alphabets_element:
             if alphabet.tag == 'alphabet':
                 stack_alphabets.add(alphabet.attrib['letter'])
+                self.stack_table.intern(alphabet.attrib['letter'])
 
             elif alphabet.tag == 'tail':
                 if stack_tail_letter != None:
@@ -41,6 +783,7 @@ class PDA:
 
                 else:
                     stack_tail_letter = alphabet.attrib['letter']
+                    self.stack_table.intern(stack_tail_letter)
 
         if stack_tail_letter == None:
             raise Exception('No tail letter for stack!')
@@ -50,8 +793,7 @@ class PDA:
         self.stack_tail_letter = stack_tail_letter
 
 
-    def parse_states(self):
-        root_states_element = self.root.find('States')
+    def parse_states(self, root_states_element):
         states_element = root_states_element.findall('state')
         initial_state_element = root_states_element.find('initialState')
         final_states_element = root_states_element.find('FinalStates')
@@ -61,6 +803,7 @@ class PDA:
 
         for state in states_element:
             states.add(state.attrib['name'])
+            self.state_table.intern(state.attrib['name'])
 
         for state in final_states_element:
             final_states.add(state.attrib['name'])
@@ -68,62 +811,1308 @@ class PDA:
         self.states = states
         self.initial_state = initial_state_element.attrib['name']
         self.final_states = final_states
+        self.state_table.intern(self.initial_state)
+
+
+    def parse_transition(self, transition):
+        self.transitions.append(
+            transition.attrib['source'],
+            transition.attrib['destination'],
+            transition.attrib['input'],
+            transition.attrib['stackRead'],
+            transition.attrib['stackWrite']
+        )
+
+
+    def save_compiled(self, file_name):
+        # Layout: header (magic, version, metadata length, transition count,
+        # stack write symbol count), JSON metadata with the symbol tables,
+        # then the transition columns as little-endian int32, 8-byte aligned.
+        trs = self.transitions
+        meta = json.dumps({
+            'states': self.state_table.names,
+            'inputs': self.input_table.names,
+            'stack': self.stack_table.names,
+            'declared_states': sorted(self.states),
+            'input_alphabets': sorted(self.input_alphabets),
+            'stack_alphabets': sorted(self.stack_alphabets),
+            'stack_tail_letter': self.stack_tail_letter,
+            'initial_state': self.initial_state,
+            'final_states': sorted(self.final_states),
+            'file_name': self.file_name
+        }).encode()
+        meta += b' ' * (-(COMPILED_HEADER.size + len(meta)) % 8)
+
+        with open(file_name, 'wb') as f:
+            f.write(COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, len(meta), len(trs), len(trs.write_symbols)))
+            f.write(meta)
+            for column in TRANSITION_COLUMNS:
+                data = array('i', getattr(trs, column))
+                if sys.byteorder != 'little':
+                    data.byteswap()
+                f.write(data.tobytes())
+                f.write(b'\0' * (-len(data) * 4 % 8))
+
+
+    @classmethod
+    def from_compiled(cls, file_name, metrics=None):
+        started = time.perf_counter()
+        with open(file_name, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, meta_length, n_transitions, n_write_symbols = COMPILED_HEADER.unpack_from(buffer)
+        if magic != COMPILED_MAGIC:
+            raise Exception('Not a compiled PDA file: "{}"'.format(file_name))
+        if version != COMPILED_VERSION:
+            raise Exception('Unsupported compiled PDA version {} in "{}"'.format(version, file_name))
+
+        offset = COMPILED_HEADER.size
+        meta = json.loads(bytes(buffer[offset:offset + meta_length]))
+        offset += meta_length
+
+        pda = cls.__new__(cls)
+        pda.file_name = meta['file_name']
+        pda.state_table = SymbolTable(meta['states'])
+        pda.input_table = SymbolTable(meta['inputs'])
+        pda.stack_table = SymbolTable(meta['stack'])
+        pda.states = set(meta['declared_states'])
+        pda.input_alphabets = set(meta['input_alphabets'])
+        pda.stack_alphabets = set(meta['stack_alphabets'])
+        pda.stack_tail_letter = meta['stack_tail_letter']
+        pda.initial_state = meta['initial_state']
+        pda.final_states = set(meta['final_states'])
+
+        trs = TransitionTable(pda.state_table, pda.input_table, pda.stack_table)
+        view = memoryview(buffer)
+        lengths = (n_transitions,) * 4 + (n_transitions + 1, n_write_symbols)
+        for column, length in zip(TRANSITION_COLUMNS, lengths):
+            data = view[offset:offset + length * 4].cast('i')
+            if sys.byteorder != 'little':
+                data = array('i', data)
+                data.byteswap()
+            setattr(trs, column, data)
+            offset += length * 4 + (-length * 4 % 8)
+
+        trs.buffer = buffer
+        pda.transitions = trs
+        if metrics is not None:
+            pda.metrics = metrics
+            metrics.add_time('map compiled', time.perf_counter() - started)
+            pda.count_transitions()
+        return pda
+
+
+    def accepts(self, word, mode='final', max_configurations=100000):
+        return self.run([word], mode, max_configurations)[0]
+
+
+    def run(self, words, mode='final', max_configurations=100000):
+        # Breadth-first search over (state, position, stack node)
+        # configurations for each word. mode is 'final' (input consumed in a
+        # final state) or 'empty' (input consumed with an empty stack). A word
+        # whose search visits more than max_configurations configurations,
+        # e.g. through a pushing lambda loop, gets None instead of a verdict.
+        if mode not in ('final', 'empty'):
+            raise Exception('Unknown acceptance mode: "{}"'.format(mode))
+
+        trs = self.transitions
+        by_source = trs.by_source
+        nodes = StackNodes()
+        initial = self.state_table.intern(self.initial_state)
+        start = nodes.push(0, self.stack_table.intern(self.stack_tail_letter))
+        final = {self.state_table.ids[state] for state in self.final_states if state in self.state_table}
+        results = []
+
+        for word in words:
+            symbols = [self.input_table.ids.get(symbol, NONE) for symbol in word]
+            if NONE in symbols:
+                results.append(False)
+                continue
+
+            length = len(symbols)
+            seen = {(initial, 0, start)}
+            queue = deque(seen)
+            result = False
+
+            while queue:
+                state, position, node = queue.popleft()
+                if position == length and (state in final if mode == 'final' else node == 0):
+                    result = True
+                    break
+
+                top = nodes.symbol[node]
+                below = nodes.below[node]
+                moves = [(LAMBDA, position)]
+                if position < length:
+                    moves.append((symbols[position], position + 1))
+
+                for _input, next_position in moves:
+                    for stack_read, base in ((top, below), (LAMBDA, node)) if node else ((LAMBDA, node),):
+                        for i in by_source.get((state, _input, stack_read), ()):
+                            configuration = (trs.destination[i], next_position, nodes.push_all(base, trs.stack_write(i)))
+                            if configuration not in seen:
+                                seen.add(configuration)
+                                queue.append(configuration)
+
+                if len(seen) > max_configurations:
+                    result = None
+                    break
+
+            results.append(result)
+
+        return results
+
+
+    def state_components(self):
+        # Strongly connected components of the state graph (iterative Tarjan),
+        # as lists of state ids.
+        trs = self.transitions
+        successors = {}
+        for source, destination in zip(trs.source, trs.destination):
+            successors.setdefault(source, set()).add(destination)
+
+        index = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        components = []
+        for root in range(len(self.state_table)):
+            if root in index:
+                continue
+
+            work = [(root, iter(successors.get(root, ())))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(successors.get(child, ()))))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(sorted(component))
+
+        return components
+
+
+    def is_large_diagram(self):
+        return len(self.state_table) > LARGE_DIAGRAM_STATES or len(self.transitions) > LARGE_DIAGRAM_TRANSITIONS
+
+
+    def diagram_groups(self, max_states=MAX_GROUP_STATES):
+        # State name -> cluster name for every strongly connected component
+        # with more than one state; other states stay as they are. Components
+        # of more than max_states states are cut into parts of at most that
+        # many, taken in breadth-first order so each part stays connected
+        # where it can.
+        names = self.state_table.names
+        trs = self.transitions
+        neighbours = {}
+        for source, destination in zip(trs.source, trs.destination):
+            neighbours.setdefault(source, set()).add(destination)
+            neighbours.setdefault(destination, set()).add(source)
+
+        groups = {}
+        components = sorted((c for c in self.state_components() if len(c) > 1), key=lambda c: c[0])
+        for number, component in enumerate(components, 1):
+            if len(component) <= max_states:
+                group = 'SCC {} ({} states)'.format(number, len(component))
+                for state in component:
+                    groups[names[state]] = group
+                continue
 
+            members = set(component)
+            order = []
+            seen = set()
+            for root in component:
+                if root in seen:
+                    continue
 
-    def parse_transitions(self):
-        transitions_element = self.root.find('Transitions')
-        transitions = []
+                seen.add(root)
+                queue = deque([root])
+                while queue:
+                    state = queue.popleft()
+                    order.append(state)
+                    for neighbour in sorted(neighbours.get(state, ())):
+                        if neighbour in members and neighbour not in seen:
+                            seen.add(neighbour)
+                            queue.append(neighbour)
 
-        for transition in transitions_element:
-            source = transition.attrib['source']
-            destination = transition.attrib['destination']
-            _input = transition.attrib['input']
-            stack_read = transition.attrib['stackRead']
-            stack_write = transition.attrib['stackWrite']
+            for part, start in enumerate(range(0, len(order), max_states), 1):
+                states = order[start:start + max_states]
+                group = 'SCC {}.{} ({} states)'.format(number, part, len(states))
+                for state in states:
+                    groups[names[state]] = group
 
-            transitions.append({
-                'source': source,
-                'destination': destination,
-                'input': _input,
-                'stack_read': stack_read,
-                'stack_write': stack_write
-            })
+        return groups
 
-        self.transitions = transitions
+
+    def read_groups(self, file_name):
+        # User clusters for the diagram from a JSON object mapping each
+        # cluster name to a list of state names, as a diagram_groups mapping
+        with open(file_name, encoding='utf-8') as f:
+            data = json.load(f)
+
+        if not isinstance(data, dict):
+            raise Exception('Groups file must map cluster names to lists of states: "{}"'.format(file_name))
+
+        groups = {}
+        for group, states in data.items():
+            if not isinstance(states, list):
+                raise Exception('States of group "{}" must be a list'.format(group))
+            for state in states:
+                if state not in self.states:
+                    raise Exception('Unknown state "{}" in group "{}"'.format(state, group))
+                if groups.setdefault(state, group) != group:
+                    raise Exception('State "{}" is in groups "{}" and "{}"'.format(state, groups[state], group))
+
+        return groups
+
+
+    def default_groups(self):
+        # A few states with many transitions only need their edges
+        # aggregated; clustering would hide the whole machine.
+        return self.diagram_groups() if len(self.state_table) > LARGE_DIAGRAM_STATES else {}
+
+
+    def to_dot(self, groups=None, focus=None):
+        # Graphviz source of the state diagram. Parallel transitions between
+        # the same pair of nodes share one edge with a label line each.
+        # Large automata (or an explicit groups mapping of state -> cluster
+        # name) collapse each group into a single cluster node, except for
+        # the states in focus, which are drawn in full; aggregated edges
+        # then carry a transition count instead of every label.
+        large = self.is_large_diagram()
+        if groups is None and focus is None and not large:
+            return self.dot_source({}, set(), False)
+
+        if groups is None:
+            groups = self.default_groups()
+
+        return self.dot_source(groups, set(focus or ()), True)
+
+
+    def dot_source(self, groups, focus, summarize):
+        def node(state):
+            return state if state in focus else groups.get(state, state)
+
+        edges = {}
+        internal = {}
+        for source, destination, _input, stack_read, stack_write in self.transitions.rows():
+            source_node = node(source)
+            destination_node = node(destination)
+            if source_node == destination_node and source_node != source:
+                internal[source_node] = internal.get(source_node, 0) + 1
+                continue
+
+            label = '{},{},{}'.format(PDA.lamb(_input), PDA.lamb(stack_read), PDA.lamb(stack_write))
+            edges.setdefault((source_node, destination_node), []).append(label)
+
+        clusters = sorted({node(state) for state in groups} - set(groups) - focus)
+        visible = {node(state) for state in self.states} | {node for edge in edges for node in edge}
+        initial = node(self.initial_state)
+
+        lines = ['digraph pda_machine {']
+        if len(visible) > SFDP_THRESHOLD:
+            lines.append('\tlayout=sfdp overlap=prism outputorder=edgesfirst')
+        lines.extend([
+            '\trankdir=LR size="8,5"',
+            '\tnode [shape=plaintext]',
+            '\t" "',
+            '\tnode [shape=circle]',
+            '\t' + dot_quote(initial),
+            '\t" " -> {} [label=" "]'.format(dot_quote(initial)),
+            '\tnode [shape=doublecircle]'
+        ])
+        lines.extend('\t' + dot_quote(state) for state in sorted(self.final_states) if node(state) == state)
+        if clusters:
+            lines.append('\tnode [shape=box3d]')
+            lines.extend('\t{} [label="{}\\n{} internal transitions"]'.format(
+                dot_quote(cluster), dot_quote(cluster)[1:-1], internal.get(cluster, 0)) for cluster in clusters)
+        lines.append('\tnode [shape=circle]')
+
+        for (source, destination), labels in edges.items():
+            if summarize and len(labels) > MAX_EDGE_LABELS:
+                label = '{} transitions'.format(len(labels))
+            else:
+                label = '\\n'.join(dot_quote(label)[1:-1] for label in labels)
+            lines.append('\t{} -> {} [label="{}"]'.format(dot_quote(source), dot_quote(destination), label))
+        lines.append('}')
+
+        return '\n'.join(lines) + '\n'
 
 
     @staticmethod
     def lamb(inp, empty=False):
         if empty:
-            return '' if inp in ('', 'lambda') else inp
+            return '' if inp in LAMBDAS else inp
 
-        return 'λ' if inp in ('', 'lambda') else inp
+        return 'λ' if inp in LAMBDAS else inp
 
 
-    def convert_to_cfg(self):
-        result_cfg = []
+    def triple(self, p, stack_symbol, q):
+        return (p * len(self.stack_table) + stack_symbol) * len(self.state_table) + q
 
-        for tr in self.transitions:
-            if tr['stack_write'] in ('', 'lambda'):
-                result_cfg.append('({}{}{}) → {}'.format(tr['source'], tr['stack_read'], tr['destination'], PDA.lamb(tr['input'])))
 
-            elif len(tr['stack_write']) == 2:
-                for s in self.states:
-                    for bs in self.states:
-                        result_cfg.append('({}{}{}) → {}({}{}{})({}{}{})'.format(
-                            tr['source'],
-                            tr['stack_read'],
-                            s,
-                            PDA.lamb(tr['input'], True),
-                            self.initial_state,
-                            tr['stack_write'][0],
-                            bs,
-                            bs,
-                            tr['stack_write'][1],
-                            s
-                        ))
+    def split_triple(self, triple):
+        n_states = len(self.state_table)
+        rest, q = divmod(triple, n_states)
+        p, stack_symbol = divmod(rest, len(self.stack_table))
+        return p, stack_symbol, q
+
+
+    def n_triples(self):
+        return len(self.state_table) * len(self.stack_table) * len(self.state_table)
+
+
+    def chain(self, chain_id, s):
+        # Chain nonterminals are numbered after the triples: [r B1..Bk s]
+        # derives what (r B1 s1)(s1 B2 s2)..(sk-1 Bk s) derives, so a write of
+        # n > 2 symbols costs |Q|² productions plus |Q|² for each chain, which
+        # are shared by every write with the same destination and prefix.
+        return self.n_triples() + chain_id * len(self.state_table) + s
+
+
+    def item(self, key, end):
+        # Nonterminal id of an analysis item, see grammar_rules
+        if isinstance(key, tuple):
+            return self.triple(key[0], key[1], end)
+        return self.chain(key, end)
+
+
+    def check_transition(self, index):
+        trs = self.transitions
+        if trs.stack_read[index] == LAMBDA:
+            raise Exception('Stack read should not be lambda: "{}"'.format(', '.join(trs.row(index))))
+
+
+    def declared_states(self):
+        # Ids of the states declared in <States>, in table order; the triple
+        # enumeration ranges over these only.
+        ids = self.state_table.ids
+        return sorted(ids[state] for state in self.states)
+
+
+    def add_state(self, state):
+        self.states.add(state)
+        return self.state_table.intern(state)
+
+
+    def remove_state(self, state):
+        self.states.discard(state)
+        self.final_states.discard(state)
+
+
+    def start_states(self):
+        # End states q of the start triples (initial, tail, q): every state
+        # for acceptance by empty stack, else the drain state and the final
+        # states, which accept with whatever is left on the stack or with
+        # none at all
+        if self.acceptance == 'empty':
+            return self.declared_states()
+
+        return [self.drain_state] + sorted(self.state_table.intern(state) for state in self.final_states)
+
+
+    def start_triples(self):
+        initial = self.state_table.intern(self.initial_state)
+        tail = self.stack_table.intern(self.stack_tail_letter)
+        return [self.triple(initial, tail, q) for q in self.start_states()]
+
+
+    def start_symbol(self):
+        # Id of S, after the chain nonterminals; only final mode emits it
+        return self.chain(len(self.transitions.chains), 0)
+
+
+    def start_symbols(self):
+        return [self.start_symbol()] if self.acceptance == 'final' else self.start_triples()
+
+
+    def with_acceptance(self, mode):
+        # This PDA converted for an acceptance mode. For 'final' that is a
+        # copy accepting by empty stack: a fresh drain state qe is entered by
+        # popping any symbol in a final state and pops everything after that,
+        # |Γ| transitions per final state plus |Γ| on qe. The start symbol
+        # only derives (q0 Z qe) and (q0 Z f), so unlike the textbook
+        # construction no new bottom marker is needed.
+        if mode not in ACCEPTANCE_MODES:
+            raise Exception('Unknown acceptance mode: "{}"'.format(mode))
+        if mode == self.acceptance:
+            return self
+        if mode == 'empty':
+            raise Exception('A final state conversion can not be turned back into an empty stack one')
+
+        # deepcopy goes through __getstate__, which leaves the metrics behind
+        pda = copy.deepcopy(self)
+        pda.metrics = self.metrics
+        pda.acceptance = mode
+        drain = DRAIN_STATE
+        suffix = 0
+        while drain in pda.state_table:
+            suffix += 1
+            drain = '{}{}'.format(DRAIN_STATE, suffix)
+        pda.drain_state = pda.add_state(drain)
+
+        trs = pda.transitions
+        stack = pda.stack_table.names
+        for state in sorted(pda.final_states, key=pda.state_table.intern) + [drain]:
+            for symbol in list(stack):
+                trs.append(state, drain, LAMBDAS[0], symbol, LAMBDAS[0])
+
+        return pda
+
+
+    def count_productions(self):
+        trs = self.transitions
+        n_states = len(self.states)
+        count = len(trs.chains) * n_states * n_states
+        if self.acceptance != 'empty':
+            count += len(self.start_states())
+
+        for i in range(len(trs)):
+            write_length = trs.write_offsets[i + 1] - trs.write_offsets[i]
+            count += 1 if write_length == 0 else n_states if write_length == 1 else n_states * n_states
+
+        return count
+
+
+    def grammar_rules(self):
+        # The shape of the grammar for the analysis. Items are (key, end)
+        # pairs: key (p, A) with end q is the triple (p A q), an int key is a
+        # chain id with its end state. Returns the pop items that seed
+        # productivity and (result, left, symbol) rules, meaning item
+        # (left, s) followed by the triple (s symbol q) derives (result, q);
+        # for unit rules symbol is NONE and (left, q) alone derives (result, q).
+        trs = self.transitions
+        chains = trs.chains
+        seeds = []
+        rules = []
+
+        for i in range(len(trs)):
+            self.check_transition(i)
+            key = (trs.source[i], trs.stack_read[i])
+            destination = trs.destination[i]
+            stack_write = tuple(trs.stack_write(i))
+            if not stack_write:
+                seeds.append((key, destination))
+            elif len(stack_write) == 1:
+                rules.append((key, (destination, stack_write[0]), NONE))
+            elif len(stack_write) == 2:
+                rules.append((key, (destination, stack_write[0]), stack_write[1]))
+            else:
+                rules.append((key, chains[destination, stack_write[:-1]], stack_write[-1]))
+
+        for (destination, prefix), chain in chains.items():
+            left = (destination, prefix[0]) if len(prefix) == 2 else chains[destination, prefix[:-1]]
+            rules.append((chain, left, prefix[-1]))
+
+        return seeds, list(dict.fromkeys(rules))
+
+
+    def productive_triples(self, seeds, rules):
+        # Fixpoint over the grammar_rules items, seeded by the pop
+        # transitions. Returns the set of productive items and, per key, the
+        # states ending a productive item in ascending order.
+        unit = {}
+        by_left = {}
+        by_symbol = {}
+        for result, left, symbol in rules:
+            if symbol == NONE:
+                unit.setdefault(left, []).append(result)
+            else:
+                by_left.setdefault(left, []).append((symbol, result))
+                by_symbol.setdefault(symbol, []).append((left, result))
+
+        productive = set()
+        ends = {}
+        worklist = list(seeds)
+
+        while worklist:
+            item = worklist.pop()
+            if item in productive:
+                continue
+
+            productive.add(item)
+            key, end = item
+            ends.setdefault(key, []).append(end)
+
+            for result in unit.get(key, ()):
+                worklist.append((result, end))
+
+            for symbol, result in by_left.get(key, ()):
+                for q in ends.get((end, symbol), ()):
+                    worklist.append((result, q))
+
+            if isinstance(key, tuple):
+                p, stack_symbol = key
+                for left, result in by_symbol.get(stack_symbol, ()):
+                    if (left, p) in productive:
+                        worklist.append((result, end))
+
+        for states in ends.values():
+            states.sort()
+
+        return productive, ends
+
+
+    def reachable_triples(self, rules, productive, ends):
+        # Productive items reachable from the start triples
+        # through productions whose bodies are productive.
+        by_result = {}
+        for result, left, symbol in rules:
+            by_result.setdefault(result, []).append((left, symbol))
+
+        start = (self.state_table.intern(self.initial_state), self.stack_table.intern(self.stack_tail_letter))
+        worklist = [(start, q) for q in self.start_states() if (start, q) in productive]
+        reachable = set()
+
+        while worklist:
+            item = worklist.pop()
+            if item in reachable:
+                continue
+
+            reachable.add(item)
+            key, q = item
+            for left, symbol in by_result.get(key, ()):
+                if symbol == NONE:
+                    if (left, q) in productive:
+                        worklist.append((left, q))
+                    continue
+
+                for s in ends.get(left, ()):
+                    if ((s, symbol), q) in productive:
+                        worklist.append((left, s))
+                        worklist.append(((s, symbol), q))
+
+        return reachable
+
+
+    def iter_productions(self, prune=False, transitions=None, analysis=None):
+        # Yields (head, terminal, left, right) integer records: head, left and
+        # right are triple or chain ids (NONE for an absent body symbol),
+        # terminal is an input symbol id or LAMBDA. transitions restricts the
+        # output to a range of transition ids and leaves out the start and
+        # chain productions, see iter_start_productions and
+        # iter_chain_productions; analysis is a precomputed analyze() result.
+        if prune:
+            analysis = analysis or self.analyze()
+        if transitions is None:
+            yield from self.iter_start_productions(prune, analysis)
+
+        if prune:
+            yield from self.iter_pruned_productions(
+                range(len(self.transitions)) if transitions is None else transitions, analysis)
+            if transitions is None:
+                yield from self.iter_chain_productions(True, analysis)
+            return
+
+        trs = self.transitions
+        n_states = len(self.state_table)
+        n_stack = len(self.stack_table)
+        states = self.declared_states()
+        chains = trs.chains
+
+        for i in range(len(trs)) if transitions is None else transitions:
+            self.check_transition(i)
+            head_base = (trs.source[i] * n_stack + trs.stack_read[i]) * n_states
+            terminal = trs.input[i]
+            destination = trs.destination[i]
+            stack_write = trs.stack_write(i)
+
+            if not stack_write:
+                yield head_base + destination, terminal, NONE, NONE
+
+            elif len(stack_write) == 1:
+                left_base = (destination * n_stack + stack_write[0]) * n_states
+                for s in states:
+                    yield head_base + s, terminal, left_base + s, NONE
+
+            else:
+                if len(stack_write) == 2:
+                    left_base = (destination * n_stack + stack_write[0]) * n_states
+                else:
+                    left_base = self.chain(chains[destination, tuple(stack_write[:-1])], 0)
+                right_symbol = stack_write[-1] * n_states
+
+                for s in states:
+                    head = head_base + s
+                    for bs in states:
+                        yield head, terminal, left_base + bs, (bs * n_stack) * n_states + right_symbol + s
+
+        if transitions is None:
+            yield from self.iter_chain_productions()
+
+
+    def iter_start_productions(self, prune=False, analysis=None, force=False):
+        # S → (q0 Z q) for the start triples of final mode, pruned to the
+        # productive ones; in empty mode only with force, for output formats
+        # that need a single start symbol
+        if self.acceptance == 'empty' and not force:
+            return
+
+        start = self.start_symbol()
+        productive = prune and (analysis or self.analyze())[0]
+        initial = self.state_table.intern(self.initial_state)
+        tail = self.stack_table.intern(self.stack_tail_letter)
+        for q in self.start_states():
+            if not prune or ((initial, tail), q) in productive:
+                yield start, LAMBDA, self.triple(initial, tail, q), NONE
+
+
+    def iter_chain_productions(self, prune=False, analysis=None):
+        # [r B1..Bk s] → [r B1..Bk-1 bs](bs Bk s), or (r B1 bs)(bs B2 s) for
+        # k = 2, for the chains in TransitionTable.chains order
+        chains = self.transitions.chains
+        if prune:
+            productive, ends, heads = analysis or self.analyze()
+            triple = self.triple
+            for (destination, prefix), chain in chains.items():
+                left = (destination, prefix[0]) if len(prefix) == 2 else chains[destination, prefix[:-1]]
+                symbol = prefix[-1]
+                for s in heads.get(chain, ()):
+                    head = self.chain(chain, s)
+                    for bs in ends.get(left, ()):
+                        if ((bs, symbol), s) in productive:
+                            yield head, LAMBDA, self.item(left, bs), triple(bs, symbol, s)
+            return
+
+        n_states = len(self.state_table)
+        n_stack = len(self.stack_table)
+        states = self.declared_states()
+
+        for (destination, prefix), chain in chains.items():
+            if len(prefix) == 2:
+                left_base = (destination * n_stack + prefix[0]) * n_states
+            else:
+                left_base = self.chain(chains[destination, prefix[:-1]], 0)
+            right_symbol = prefix[-1] * n_states
+
+            for s in states:
+                head = self.chain(chain, s)
+                for bs in states:
+                    yield head, LAMBDA, left_base + bs, (bs * n_stack) * n_states + right_symbol + s
+
+
+    def analyze(self):
+        # (productive items, ends, heads): heads maps each key to the
+        # ascending end states of its reachable items, see grammar_rules
+        with self.phase('analysis'):
+            seeds, rules = self.grammar_rules()
+            productive, ends = self.productive_triples(seeds, rules)
+            reachable = self.reachable_triples(rules, productive, ends)
+
+            heads = {}
+            for key, end in reachable:
+                heads.setdefault(key, []).append(end)
+            for states in heads.values():
+                states.sort()
+
+        if self.metrics is not None:
+            self.metrics.count('productive triples', len(productive))
+            self.metrics.count('reachable triples', len(reachable))
+        return productive, ends, heads
+
+
+    def iter_pruned_productions(self, transitions, analysis):
+        trs = self.transitions
+        triple = self.triple
+        chains = trs.chains
+        productive, ends, heads = analysis
+
+        for i in transitions:
+            p = trs.source[i]
+            stack_read = trs.stack_read[i]
+            destination = trs.destination[i]
+            terminal = trs.input[i]
+            stack_write = trs.stack_write(i)
+            if len(stack_write) > 2:
+                left = chains[destination, tuple(stack_write[:-1])]
+            elif stack_write:
+                left = (destination, stack_write[0])
+
+            for q in heads.get((p, stack_read), ()):
+                if not stack_write:
+                    if q == destination:
+                        yield triple(p, stack_read, q), terminal, NONE, NONE
+                    continue
+
+                head = triple(p, stack_read, q)
+                if len(stack_write) == 1:
+                    if (left, q) in productive:
+                        yield head, terminal, triple(destination, stack_write[0], q), NONE
+                    continue
+
+                symbol = stack_write[-1]
+                for s in ends.get(left, ()):
+                    if ((s, symbol), q) in productive:
+                        yield head, terminal, self.item(left, s), triple(s, symbol, q)
+
 
+    def productions(self, prune=False, vectorize=None):
+        # Integer production table in iter_productions order. The unpruned
+        # table is built with NumPy when it is installed (or when vectorize is
+        # True), else record by record.
+        if prune:
+            table = ProductionTable(self, 0)
+            for production in self.iter_productions(True):
+                table.append(*production)
+            return table
+
+        if vectorize or vectorize is None and load_numpy() is not None:
+            return self.vectorized_productions()
+
+        table = ProductionTable(self, self.count_productions())
+        head = table.head
+        terminal = table.terminal
+        left = table.left
+        right = table.right
+
+        for index, production in enumerate(self.iter_productions()):
+            head[index], terminal[index], left[index], right[index] = production
+
+        return table
+
+
+    def vectorized_productions(self, progress=None, chunk_size=256):
+        # Every transition and chain is a block of productions: a pop is one
+        # record, a one-symbol push |Q| records over s, a longer push or a
+        # chain |Q|² records over (s, bs), see iter_productions. The (s, bs)
+        # cross product is built once and broadcast against the parameters
+        # of chunk_size blocks of a kind at a time, which are then scattered
+        # to their offsets. progress, if given, is called after every chunk
+        # with the transitions and productions done so far.
+        np = load_numpy()
+        if np is None:
+            raise Exception('Vectorized conversion needs NumPy')
+
+        trs = self.transitions
+        n_states = len(self.state_table)
+        n_stack = len(self.stack_table)
+        chains = trs.chains
+        n_transitions = len(trs)
+
+        source = np.asarray(trs.source, dtype=np.int64)
+        destination = np.asarray(trs.destination, dtype=np.int64)
+        stack_read = np.asarray(trs.stack_read, dtype=np.int64)
+        offsets = np.asarray(trs.write_offsets, dtype=np.int64)
+        symbols = np.asarray(trs.write_symbols, dtype=np.int64)
+        if (stack_read == LAMBDA).any():
+            self.check_transition(int(np.flatnonzero(stack_read == LAMBDA)[0]))
+
+        lengths = np.diff(offsets)
+        written = lengths > 0
+        first = np.zeros(n_transitions, dtype=np.int64)
+        last = np.zeros(n_transitions, dtype=np.int64)
+        first[written] = symbols[offsets[:-1][written]]
+        last[written] = symbols[offsets[1:][written] - 1]
+
+        # Block parameters, transitions first and then the chains
+        head_base = np.concatenate([(source * n_stack + stack_read) * n_states,
+                                    [self.chain(chain, 0) for chain in range(len(chains))]]).astype(np.int64)
+        terminal = np.concatenate([np.asarray(trs.input, dtype=np.int64),
+                                   np.full(len(chains), LAMBDA, dtype=np.int64)])
+        left_base = (destination * n_stack + first) * n_states
+        for i in np.flatnonzero(lengths > 2):
+            stack_write = tuple(trs.stack_write(i))
+            left_base[i] = self.chain(chains[trs.destination[i], stack_write[:-1]], 0)
+        chain_left = [(r * n_stack + prefix[0]) * n_states if len(prefix) == 2 else self.chain(chains[r, prefix[:-1]], 0)
+                      for r, prefix in chains]
+        left_base = np.concatenate([left_base, chain_left]).astype(np.int64)
+        right_symbol = np.concatenate([last, [prefix[-1] for _, prefix in chains]]).astype(np.int64) * n_states
+        kind = np.concatenate([np.minimum(lengths, 2), np.full(len(chains), 2, dtype=np.int64)])
+
+        states = np.asarray(self.declared_states(), dtype=np.int64)
+        m = len(states)
+        sizes = np.array([1, m, m * m], dtype=np.int64)[kind]
+        start_productions = list(self.iter_start_productions())
+        starts = np.concatenate([[len(start_productions)], np.cumsum(sizes)[:-1] + len(start_productions)]).astype(np.int64)
+        total = int(sizes.sum()) + len(start_productions)
+
+        # Columns in the C long layout of ProductionTable, copied in as raw bytes
+        column = np.dtype('l')
+        head = np.empty(total, dtype=column)
+        terminals = np.empty(total, dtype=column)
+        left = np.full(total, NONE, dtype=column)
+        right = np.full(total, NONE, dtype=column)
+        for index, (start, _, triple, _) in enumerate(start_productions):
+            head[index], terminals[index], left[index] = start, LAMBDA, triple
+
+        pops = np.flatnonzero(kind == 0)
+        head[starts[pops]] = head_base[pops] + destination[pops]
+        terminals[starts[pops]] = terminal[pops]
+
+        blocks = len(pops)
+        emitted = len(start_productions) + len(pops)
+        s = np.repeat(states, m)
+        bs = np.tile(states, m)
+        for block_kind in (1, 2):
+            indices = np.flatnonzero(kind == block_kind) if m else []
+            for chunk in range(0, len(indices), chunk_size):
+                part = indices[chunk:chunk + chunk_size]
+                if block_kind == 1:
+                    positions = (starts[part, None] + np.arange(m)).ravel()
+                    head[positions] = (head_base[part, None] + states).ravel()
+                    terminals[positions] = np.repeat(terminal[part], m)
+                    left[positions] = (left_base[part, None] + states).ravel()
+                else:
+                    positions = (starts[part, None] + np.arange(m * m)).ravel()
+                    head[positions] = (head_base[part, None] + s).ravel()
+                    terminals[positions] = np.repeat(terminal[part], m * m)
+                    left[positions] = (left_base[part, None] + bs).ravel()
+                    right[positions] = (right_symbol[part, None] + bs * (n_stack * n_states) + s).ravel()
+
+                blocks += len(part)
+                emitted += len(positions)
+                if progress is not None:
+                    progress(min(blocks, n_transitions), emitted)
+
+        table = ProductionTable(self, 0)
+        for name, values in zip(('head', 'terminal', 'left', 'right'), (head, terminals, left, right)):
+            getattr(table, name).frombytes(memoryview(values).cast('B'))
+        return table
+
+
+    def iter_cfg(self, prune=False, transitions=None, formatter=None):
+        formatter = formatter or ProductionFormatter(self)
+        if self.metrics is not None:
+            yield from self.iter_cfg_measured(formatter, prune, transitions)
+            return
+
+        for production in self.iter_productions(prune, transitions):
+            yield formatter.text(*production)
+
+
+    def iter_cfg_measured(self, formatter, prune, transitions, batch_size=4096):
+        # iter_cfg in batches, so generating records (the triple loops) and
+        # formatting them are timed apart at a cost per batch, not per line
+        metrics = self.metrics
+        if transitions is None:
+            metrics.count('candidate productions', self.count_productions())
+        productions = self.iter_productions(prune, transitions)
+        text = formatter.text
+        while True:
+            started = time.perf_counter()
+            batch = list(islice(productions, batch_size))
+            generated = time.perf_counter()
+            lines = [text(*production) for production in batch]
+            metrics.add_time('productions', generated - started)
+            metrics.add_time('format', time.perf_counter() - generated)
+            if not batch:
+                return
+
+            metrics.count('productions emitted', len(batch))
+            yield from lines
+
+
+    def convert_to_cfg(self, prune=False):
+        return list(self.iter_cfg(prune))
+
+
+    def write_cfg(self, sink, chunk_size=1 << 16, prune=False, formatter=None):
+        return write_lines(sink, self.iter_cfg(prune, formatter=formatter), chunk_size, self.metrics)
+
+
+    def shard_transitions(self, shards):
+        # Splits the transitions into at most `shards` contiguous ranges of
+        # roughly equal production count, so merging shards in order
+        # reproduces the sequential output.
+        trs = self.transitions
+        n_states = len(self.states)
+        costs = [min(trs.write_offsets[i + 1] - trs.write_offsets[i], 2) for i in range(len(trs))]
+        costs = [n_states ** cost for cost in costs]
+        target = max(1, -(-sum(costs) // max(1, shards)))
+
+        ranges = []
+        start = 0
+        size = 0
+        for i, cost in enumerate(costs):
+            size += cost
+            if size >= target:
+                ranges.append(range(start, i + 1))
+                start = i + 1
+                size = 0
+
+        if start < len(costs):
+            ranges.append(range(start, len(costs)))
+
+        return ranges
+
+
+    def write_cfg_parallel(self, file_name, workers=None, prune=False, shards_per_worker=4):
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+        for i in range(len(self.transitions)):
+            self.check_transition(i)
+
+        analysis = self.analyze() if prune else None
+        start_lines = [ProductionFormatter(self).text(*production)
+                       for production in self.iter_start_productions(prune, analysis)]
+        ranges = self.shard_transitions(workers * shards_per_worker)
+        shard_dir = tempfile.mkdtemp(prefix='cfg-shards-', dir=os.path.dirname(os.path.abspath(file_name)))
+        # The chain productions come last, as one more shard
+        if self.transitions.chains:
+            ranges.append(None)
+        jobs = [(transitions, os.path.join(shard_dir, '{:06d}.part'.format(index)))
+                for index, transitions in enumerate(ranges)]
+
+        try:
+            with ProcessPoolExecutor(workers, initializer=_init_shard_worker, initargs=(self, prune, analysis)) as executor:
+                count = sum(executor.map(_convert_shard, jobs))
+
+            with open(file_name, 'wb') as output:
+                write_lines(output, start_lines)
+                for _, shard_name in jobs:
+                    with open(shard_name, 'rb') as shard:
+                        shutil.copyfileobj(shard, output, 1 << 20)
+
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+        return count + len(start_lines)
+
+
+_numpy = None
+
+
+def load_numpy():
+    # NumPy is optional and slow to import, so it is looked up on first use;
+    # None when it is not installed
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+
+    return _numpy or None
+
+
+_shard_pda = None
+_shard_prune = False
+_shard_analysis = None
+
+
+def _init_shard_worker(pda, prune, analysis):
+    global _shard_pda, _shard_prune, _shard_analysis
+    _shard_pda = pda
+    _shard_prune = prune
+    _shard_analysis = analysis
+
+
+def _convert_shard(job):
+    transitions, shard_name = job
+    formatter = ProductionFormatter(_shard_pda)
+    if transitions is None:
+        productions = _shard_pda.iter_chain_productions(_shard_prune, _shard_analysis)
+    else:
+        productions = _shard_pda.iter_productions(_shard_prune, transitions, _shard_analysis)
+    with open(shard_name, 'wb') as shard:
+        return write_lines(shard, (formatter.text(*production) for production in productions))
+
+
+def dot_quote(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def write_lines(sink, lines, chunk_size=1 << 16, metrics=None):
+    # Sockets get encoded bytes through sendall, binary files get encoded
+    # bytes through write, text files get str. Lines are buffered into
+    # chunks of roughly chunk_size characters so memory stays flat.
+    if hasattr(sink, 'sendall'):
+        write = sink.sendall
+        binary = True
+    else:
+        write = sink.write
+        binary = not isinstance(sink, io.TextIOBase)
+
+    if metrics is not None:
+        write = measured_write(write, binary, metrics)
+
+    count = 0
+    size = 0
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        size += len(line) + 1
+        count += 1
+        if size >= chunk_size:
+            chunk.append('')
+            data = '\n'.join(chunk)
+            write(data.encode() if binary else data)
+            chunk = []
+            size = 0
+
+    if chunk:
+        chunk.append('')
+        data = '\n'.join(chunk)
+        write(data.encode() if binary else data)
+
+    return count
+
+
+def measured_write(write, binary, metrics):
+    def measured(data):
+        started = time.perf_counter()
+        write(data)
+        metrics.add_time('write', time.perf_counter() - started)
+        metrics.count('bytes written', len(data) if binary else len(data.encode()))
+
+    return measured
+
+
+def expand_inputs(patterns):
+    file_names = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            file_names.extend(sorted(glob.glob(os.path.join(pattern, '*.xml'))))
+        elif glob.has_magic(pattern):
+            file_names.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            file_names.append(pattern)
+
+    return list(dict.fromkeys(file_names))
+
+
+def output_name(file_name, output_dir, suffix):
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(output_dir or os.path.dirname(file_name), stem + suffix)
+
+
+def output_names(file_names, output_dir, suffix):
+    # Output file of each input; inputs with the same stem in different
+    # directories would overwrite each other under one output directory
+    outputs = {}
+    for file_name in file_names:
+        output_file_name = output_name(file_name, output_dir, suffix)
+        other = outputs.setdefault(os.path.normcase(os.path.abspath(output_file_name)), file_name)
+        if other != file_name:
+            raise Exception('"{}" and "{}" would both be written to "{}"'.format(other, file_name, output_file_name))
+
+    return [output_name(file_name, output_dir, suffix) for file_name in file_names]
+
+
+def load(file_name, metrics=None):
+    with open(file_name, 'rb') as f:
+        compiled = f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+
+    return PDA.from_compiled(file_name, metrics) if compiled else PDA(file_name, metrics)
+
+
+def count_lines(file_name):
+    count = 0
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            count += block.count(b'\n')
+
+    return count
+
+
+def convert_file(file_name, output_file_name, prune=False, cache_dir=None, simplify=False,
+                 stats=False, profile=False, trace_memory=False, acceptance='empty', output_format='text',
+                 compression=None, names='triples', shards=1):
+    # Returns (productions, load seconds, convert seconds, simplify report,
+    # warnings, metrics); metrics is a Metrics.as_dict() when any of stats, profile or
+    # trace_memory is set, since the Metrics object itself can't be pickled.
+    # Plain text output of a large grammar is written by `shards` processes.
+    metrics = Metrics(profile=profile, trace_memory=trace_memory) if stats or profile or trace_memory else None
+    started = time.perf_counter()
+    cache = None
+    if cache_dir:
+        from cache import PDACache
+
+        cache = PDACache(cache_dir)
+        pda = cache.load(file_name, metrics)
+    else:
+        pda = load(file_name, metrics)
+    pda = pda.with_acceptance(acceptance)
+
+    loaded = time.perf_counter()
+    with pda.phase('convert'):
+        count, report, warnings = convert_loaded(pda, output_file_name, prune, cache, simplify, output_format,
+                                                 compression, names, shards)
+
+    return count, loaded - started, time.perf_counter() - loaded, report, warnings, metrics and metrics.as_dict()
+
+
+def convert_loaded(pda, output_file_name, prune, cache, simplify, output_format='text', compression=None,
+                   names='triples', shards=1):
+    report = []
+    warnings = []
+    exported = output_format != 'text' or compression is not None or names != 'triples'
+    if shards > 1 and pda.count_productions() < PARALLEL_MIN_PRODUCTIONS:
+        shards = 1
+    if simplify:
+        from grammar import simplify as simplify_grammar
+
+        table, nullable, report = simplify_grammar(pda.productions(prune), pda.start_symbols())
+        if nullable:
+            if pda.acceptance == 'final' or output_format in ('bnf', 'lark', 'antlr'):
+                # S (the start rule of these exports) never occurs in a body,
+                # so S → λ puts back the empty word and nothing else
+                table.append(pda.start_symbol(), LAMBDA, NONE, NONE)
             else:
-                raise Exception('Stack write should be 0 length or 2: "{}"'.format(tr['stack_write']))
+                # Text and binary output in empty mode start from the (q0Zq)
+                # triples, there is no single start symbol to give S → λ
+                warnings.append('the empty word is accepted but was removed from the simplified grammar')
+        if exported:
+            from export import export_grammar
+
+            count = export_grammar(pda, output_file_name, output_format, compression=compression, table=table,
+                                   names=names)
+        else:
+            with open(output_file_name, 'w', encoding='utf-8') as output:
+                count = table.write(output)
+
+    elif exported:
+        from export import export_grammar
+
+        count = export_grammar(pda, output_file_name, output_format, prune, compression, names=names)
+
+    elif cache is not None:
+        cache.write_cfg_file(pda, output_file_name, prune, shards)
+        count = count_lines(output_file_name)
+
+    elif shards > 1:
+        count = pda.write_cfg_parallel(output_file_name, shards, prune)
+
+    else:
+        with open(output_file_name, 'w', encoding='utf-8') as output:
+            count = pda.write_cfg(output, prune=prune)
+
+    return count, report, warnings
+
+
+def compile_files(file_names, output_dir, suffix):
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    failed = 0
+    for file_name, output_file_name in zip(file_names, output_names(file_names, output_dir, suffix)):
+        started = time.perf_counter()
+        try:
+            PDA(file_name).save_compiled(output_file_name)
+        except Exception as e:
+            failed += 1
+            print('{}: error: {}'.format(file_name, e), file=sys.stderr)
+            continue
+
+        print('{}: compiled in {:.3f}s -> {}'.format(file_name, time.perf_counter() - started, output_file_name))
+
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    # The CLI and process pool modules are imported here so that importing
+    # pda as a library (GUI, headless workers) stays cheap
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from export import COMPRESSIONS, EXPORT_FORMATS, compression_for
+
+    parser = argparse.ArgumentParser(prog='python -m pda', description='Headless PDA to CFG converter')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='convert PDA XML files to CFG text files')
+    convert.add_argument('inputs', nargs='+', help='XML files, directories or glob patterns')
+    convert.add_argument('-o', '--output-dir', help='directory for the CFG files (default: next to each input)')
+    convert.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    convert.add_argument('--suffix', help='output file suffix (default: by format, e.g. .cfg or .bnf.gz)')
+    convert.add_argument('--prune', action='store_true', help='emit only productive, reachable productions')
+    convert.add_argument('--cache-dir', help='reuse parsed PDAs and grammars from this cache directory')
+    convert.add_argument('--simplify', action='store_true', help='remove useless symbols, lambda and unit productions')
+    convert.add_argument('--accept', choices=ACCEPTANCE_MODES, default='empty',
+                         help='derive the words accepted by empty stack or by final state (default: empty)')
+    convert.add_argument('--format', choices=list(EXPORT_FORMATS), default='text', help='grammar output format (default: text)')
+    convert.add_argument('--compress', choices=list(COMPRESSIONS),
+                         help='compress the grammar stream (default: by the suffix, .gz or .zst)')
+    convert.add_argument('--names', choices=('triples', 'compact'), default='triples',
+                         help='name text nonterminals (pAq) or N0, N1, ... with a .legend file (default: triples)')
+    convert.add_argument('--stats', action='store_true', help='print phase timings and counters for every file')
+    convert.add_argument('--profile', action='store_true', help='print the top functions from cProfile for every file')
+    convert.add_argument('--trace-memory', action='store_true', help='report the tracemalloc peak for every file')
+    convert.add_argument('--shards', type=int,
+                         help='processes per file for large text grammars (default: the jobs left over when there '
+                              'are fewer files than jobs)')
+    compile_command = commands.add_parser('compile', help='compile PDA XML files to the binary format')
+    compile_command.add_argument('inputs', nargs='+', help='XML files, directories or glob patterns')
+    compile_command.add_argument('-o', '--output-dir', help='directory for the compiled files (default: next to each input)')
+    compile_command.add_argument('--suffix', default='.pdac', help='output file suffix (default: .pdac)')
+    args = parser.parse_args(argv)
+
+    file_names = expand_inputs(args.inputs)
+    if not file_names:
+        parser.error('no input files matched')
+
+    suffix = args.suffix
+    if suffix is None:
+        suffix = EXPORT_FORMATS[args.format] + COMPRESSIONS.get(args.compress, '')
+    try:
+        output_file_names = output_names(file_names, args.output_dir, suffix)
+    except Exception as e:
+        parser.error(str(e))
+
+    if args.command == 'compile':
+        return compile_files(file_names, args.output_dir, suffix)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    compression = args.compress or compression_for(suffix)
+    # -j spreads the files over processes; a file can use the jobs no other
+    # file needs to shard its own conversion
+    shards = args.shards or max(1, args.jobs // len(file_names))
+
+    failed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max(1, min(args.jobs, len(file_names)))) as executor:
+        futures = {}
+        for file_name, output_file_name in zip(file_names, output_file_names):
+            futures[executor.submit(convert_file, file_name, output_file_name, args.prune, args.cache_dir, args.simplify,
+                                    args.stats, args.profile, args.trace_memory, args.accept, args.format,
+                                    compression, args.names, shards)] = (file_name, output_file_name)
+
+        for future in as_completed(futures):
+            file_name, output_file_name = futures[future]
+            try:
+                count, load_time, convert_time, report, warnings, metrics = future.result()
+            except Exception as e:
+                failed += 1
+                print('{}: error: {}'.format(file_name, e), file=sys.stderr)
+                continue
+
+            print('{}: {} productions, load {:.3f}s, convert {:.3f}s -> {}'.format(
+                file_name, count, load_time, convert_time, output_file_name))
+            for stage, before, after in report:
+                print('    {}: {} -> {} productions'.format(stage, before, after))
+            for warning in warnings:
+                print('{}: warning: {}'.format(file_name, warning), file=sys.stderr)
+            if metrics is not None:
+                for line in format_metrics(metrics):
+                    print('    ' + line)
+                if 'profile' in metrics:
+                    print(metrics['profile'])
+
+    print('{} file(s), {} failed, {:.3f}s total'.format(len(file_names), failed, time.perf_counter() - started))
+    return 1 if failed else 0
+
 
-        return result_cfg
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from grammar import CompiledGrammar
+from pda import PDA, IncrementalCFG, load_numpy
+
+
+# Cross-checks of the converter on small random automata: the grammar has to
+# accept exactly the words the PDA accepts, and every way of producing the
+# grammar (vectorized, sharded, incremental) has to agree with iter_cfg.
+
+INPUTS = 'ab'
+STACK = 'ZAB'
+
+
+def random_xml(file_name, rng, n_states, n_transitions, writes=(0, 1, 2, 3)):
+    states = ['q{}'.format(i) for i in range(n_states)]
+    lines = ['<Automata type="PDA"><Alphabets><Input_alphabets>']
+    lines += ['<alphabet letter="{}"/>'.format(letter) for letter in INPUTS]
+    lines += ['</Input_alphabets><Stack_alphabets>']
+    lines += ['<alphabet letter="{}"/>'.format(letter) for letter in STACK]
+    lines += ['<tail letter="Z"/></Stack_alphabets></Alphabets><States>']
+    lines += ['<state name="{}"/>'.format(state) for state in states]
+    lines += ['<initialState name="q0"/><FinalStates>']
+    lines += ['<finalState name="{}"/>'.format(state) for state in rng.sample(states, max(1, n_states // 3))]
+    lines += ['</FinalStates></States><Transitions>']
+    for _ in range(n_transitions):
+        lines.append('<transition source="{}" destination="{}" input="{}" stackRead="{}" stackWrite="{}"/>'.format(
+            rng.choice(states), rng.choice(states), rng.choice(INPUTS + ' ').strip() or 'lambda', rng.choice(STACK),
+            ''.join(rng.choice(STACK) for _ in range(rng.choice(writes)))))
+    lines.append('</Transitions></Automata>')
+
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+class ConversionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'pda.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def random_pda(self, seed, max_states=4, max_transitions=14):
+        rng = random.Random(seed)
+        random_xml(self.file_name, rng, rng.randint(1, max_states), rng.randint(1, max_transitions))
+        return PDA(self.file_name)
+
+    def test_grammar_accepts_what_the_pda_accepts(self):
+        words = [''.join(word) for length in range(5) for word in itertools.product(INPUTS, repeat=length)]
+        for seed in range(60):
+            pda = self.random_pda(seed)
+            for mode in ('empty', 'final'):
+                verdicts = pda.run(words, mode, 20000)
+                for prune in (False, True):
+                    grammar = CompiledGrammar.from_pda(pda, prune, mode)
+                    for word, verdict in zip(words, verdicts):
+                        # None: the search gave up, e.g. on a pushing λ-loop
+                        if verdict is not None:
+                            self.assertEqual(grammar.accepts(word), verdict, (seed, mode, prune, word))
+
+    @unittest.skipIf(load_numpy() is None, 'needs NumPy')
+    def test_vectorized_productions(self):
+        for seed in range(60):
+            for mode in ('empty', 'final'):
+                pda = self.random_pda(seed).with_acceptance(mode)
+                table = pda.vectorized_productions()
+                self.assertEqual(list(table), list(pda.productions(vectorize=False)), (seed, mode))
+                self.assertEqual(len(table), pda.count_productions())
+
+    def test_write_cfg_parallel(self):
+        output_name = os.path.join(self.directory, 'pda.cfg')
+        for seed in range(4):
+            pda = self.random_pda(seed, 5, 30).with_acceptance('final' if seed % 2 else 'empty')
+            for prune in (False, True):
+                count = pda.write_cfg_parallel(output_name, 2, prune)
+                with open(output_name, encoding='utf-8') as f:
+                    lines = f.read().splitlines()
+                self.assertEqual(lines, list(pda.iter_cfg(prune)), (seed, prune))
+                self.assertEqual(count, len(lines))
+
+    def test_incremental_edits(self):
+        for seed in range(60):
+            rng = random.Random(seed)
+            pda = self.random_pda(seed, 5, 12)
+            incremental = IncrementalCFG(pda)
+            self.assertEqual(list(incremental.lines()), list(pda.iter_cfg()))
+
+            for step in range(15):
+                states = sorted(pda.states)
+                n = len(pda.transitions)
+                row = (rng.choice(states), rng.choice(states), rng.choice(INPUTS + ' ').strip(), rng.choice(STACK),
+                       ''.join(rng.choice(STACK) for _ in range(rng.choice((0, 1, 2, 3)))))
+                action = rng.random()
+                if action < 0.25:
+                    incremental.insert_transition(rng.randint(0, n), *row)
+                elif action < 0.45 and n:
+                    incremental.remove_transition(rng.randrange(n))
+                elif action < 0.65 and n:
+                    incremental.replace_transition(rng.randrange(n), *row)
+                elif action < 0.8:
+                    incremental.add_state('n{}'.format(rng.randint(0, 5)))
+                elif len(states) > 1:
+                    incremental.remove_state(rng.choice(states))
+                self.assertEqual(list(incremental.lines()), list(pda.iter_cfg()), (seed, step))
+
+
+if __name__ == '__main__':
+    unittest.main()